@@ -1,23 +1,72 @@
 """
 Vibes TCG Tracker v2 - With Card Tracking & Archetype Detection
-Flask backend with SQLite database
+Flask backend with PostgreSQL or SQLite database
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, make_response, stream_with_context, g, has_request_context
+from werkzeug.http import is_resource_modified
+import click
+import numpy as np
 import psycopg
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
 import json
+import base64
+import sqlite3
+import gzip
+import zlib
+import hashlib
 import os
 import csv
 import io
-from datetime import datetime
-from collections import Counter
+import threading
+import queue
+import time
+import re
+import contextvars
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import wraps, lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 app = Flask(__name__)
 
-# Configuration - PostgreSQL
+# Configuration - PostgreSQL, or SQLite when DATABASE_URL is unset or names a file
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+def sqlite_path(url):
+    """Database file for a SQLite DATABASE_URL, or None for PostgreSQL"""
+    if not url:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "vibes.db")
+    for prefix in ("sqlite:///", "sqlite://"):
+        if url.startswith(prefix):
+            return url[len(prefix):]
+    if url.startswith(("postgres://", "postgresql://")) or "=" in url:
+        return None
+    return url
+
+SQLITE_PATH = sqlite_path(DATABASE_URL)
+USE_SQLITE = SQLITE_PATH is not None
+
+# Zone for days when a request doesn't send ?tz=, and for timestamps written
+# before date_time was a real timestamp (those were server-local time)
+APP_TIMEZONE = os.environ.get("APP_TIMEZONE") or os.environ.get("TZ") or "UTC"
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Card Database - All Vibes TCG Cards (from official card data)
 # ─────────────────────────────────────────────────────────────────────────────
@@ -118,10 +167,193 @@ CARD_LIST = [
     "You Dropped This", "Yum Yum", "liL mOCkeR"
 ]
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Card Search Index - Prefix trie + trigram index over CARD_LIST
+# ─────────────────────────────────────────────────────────────────────────────
+
+def normalize_card_text(text):
+    """Lowercase, drop apostrophes, turn other punctuation into spaces, collapse whitespace"""
+    text = text.lower().replace("'", "").replace("\u2019", "")
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text).split())
+
+@lru_cache(maxsize=4096)
+def trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def dice(a, b):
+    """Trigram Dice similarity of two normalized strings"""
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+def edit_distance(a, b, bound=None):
+    """Edits (insert, delete, substitute, swap adjacent) turning a into b; stops early past bound"""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1])
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        # A swap can reach back two rows, so both must be past the bound
+        if bound is not None and min(current) > bound and min(previous) > bound:
+            return bound + 1
+    return current[-1]
+
+def typo_budget(text):
+    """Edits a name of this length may be off by and still count as a typo"""
+    if len(text) < 4:
+        return 0
+    return 1 if len(text) < 12 else 2
+
+class CardIndex:
+    """
+    Search index over card names, built once at startup. A trie over the
+    normalized full names and over every word answers prefix queries, and a
+    character trigram index finds misspelled input, ranked by Dice similarity
+    to the closest run of words in each name.
+    """
+    
+    # Minimum trigram similarity for a fuzzy search hit
+    FUZZY_THRESHOLD = 0.3
+    
+    def __init__(self, card_list):
+        self.cards = sorted(card_list)
+        self.normalized = [normalize_card_text(card) for card in self.cards]
+        self.by_normalized = {norm: i for i, norm in enumerate(self.normalized)}
+        self.name_trie = {}
+        self.word_trie = {}
+        self.trigram_index = {}
+        
+        for card_id, norm in enumerate(self.normalized):
+            self._trie_insert(self.name_trie, norm, card_id)
+            for word in norm.split():
+                self._trie_insert(self.word_trie, word, card_id)
+            for gram in trigrams(norm):
+                self.trigram_index.setdefault(gram, []).append(card_id)
+    
+    @staticmethod
+    def _trie_insert(trie, text, card_id):
+        # Each node keeps the ids of every card under it under the None key
+        node = trie
+        for ch in text:
+            node = node.setdefault(ch, {})
+            node.setdefault(None, set()).add(card_id)
+    
+    @staticmethod
+    def _trie_lookup(trie, prefix):
+        node = trie
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return set()
+        return node.get(None, set())
+    
+    def _candidates(self, norm):
+        """Ids of every card sharing at least one trigram with norm"""
+        candidates = set()
+        for gram in trigrams(norm):
+            candidates.update(self.trigram_index.get(gram, ()))
+        return candidates
+    
+    def _windows(self, norm, card_id):
+        """The card's name, plus each run of as many of its words as the query has"""
+        words = self.normalized[card_id].split()
+        size = min(len(norm.split()), len(words))
+        return {self.normalized[card_id]} | {
+            " ".join(words[i:i + size]) for i in range(len(words) - size + 1)
+        }
+    
+    def _similarities(self, norm):
+        """Best Dice similarity between norm and any window of each candidate card"""
+        return {
+            card_id: max(dice(norm, window) for window in self._windows(norm, card_id))
+            for card_id in self._candidates(norm)
+        }
+    
+    def search(self, query, limit=10):
+        """Ranked card names for partial or misspelled input"""
+        norm = normalize_card_text(query)
+        if not norm:
+            return []
+        
+        similarities = self._similarities(norm)
+        scores = {}
+        
+        # Best tier: full-name prefix. Next: every query word starts some word of the name.
+        for card_id in self._trie_lookup(self.name_trie, norm):
+            scores[card_id] = 3
+        words = norm.split()
+        word_hits = self._trie_lookup(self.word_trie, words[0])
+        for word in words[1:]:
+            word_hits = word_hits & self._trie_lookup(self.word_trie, word)
+        for card_id in word_hits:
+            scores.setdefault(card_id, 2)
+        
+        ranked = sorted(
+            scores,
+            key=lambda card_id: (-scores[card_id], -similarities.get(card_id, 0), self.cards[card_id])
+        )
+        if len(ranked) >= limit:
+            return [self.cards[card_id] for card_id in ranked[:limit]]
+        
+        # Last tier: typo-tolerant matches by trigram similarity alone
+        fuzzy = sorted(
+            (card_id for card_id, similarity in similarities.items()
+             if similarity >= self.FUZZY_THRESHOLD and card_id not in scores),
+            key=lambda card_id: (-similarities[card_id], self.cards[card_id])
+        )
+        # Within the ones that make the cut, fewest edits first ("potoin" -> Potion before Poppin')
+        room = limit - len(ranked)
+        if len(fuzzy) > room:
+            cutoff = similarities[fuzzy[room - 1]]
+            fuzzy = [card_id for card_id in fuzzy if similarities[card_id] >= cutoff]
+        fuzzy.sort(key=lambda card_id: min(edit_distance(norm, window) for window in self._windows(norm, card_id)))
+        return [self.cards[card_id] for card_id in (ranked + fuzzy)[:limit]]
+    
+    def canonicalize(self, name):
+        """
+        The CARD_LIST spelling of name: exact, then ignoring case/punctuation,
+        then the one card it is a typo of (a few edits away for its length).
+        None for anything else, including partial or longer names.
+        """
+        norm = normalize_card_text(name or "")
+        card_id = self.by_normalized.get(norm)
+        if card_id is not None:
+            return self.cards[card_id]
+        budget = typo_budget(norm)
+        if not budget:
+            return None
+        
+        distances = {
+            card_id: edit_distance(norm, self.normalized[card_id], budget)
+            for card_id in self._candidates(norm)
+            if abs(len(self.normalized[card_id]) - len(norm)) <= budget
+        }
+        best = [card_id for card_id, distance in distances.items() if distance <= budget]
+        if len(best) > 1:
+            closest = min(distances[card_id] for card_id in best)
+            best = [card_id for card_id in best if distances[card_id] == closest]
+        if len(best) != 1:
+            return None  # nothing close, or ambiguous
+        return self.cards[best[0]]
+
+CARD_INDEX = CardIndex(CARD_LIST)
+
+def canonical_cards(cards):
+    """Rewrite recognizable spelling variants to their CARD_LIST name; keep unknown names as given"""
+    return [CARD_INDEX.canonicalize(card) or card for card in cards]
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Archetype Aliases - Map similar names to canonical archetype
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Default aliases, seeded into the archetype_aliases table when it is created.
+# Edit live aliases through /api/archetype-aliases.
 ARCHETYPE_ALIASES = {
     # Red variants -> Red Control
     "red removal": "Red Control",
@@ -144,12 +376,15 @@ ARCHETYPE_ALIASES = {
     # Add more as needed...
 }
 
-def normalize_archetype(name):
-    """Convert archetype name to canonical form"""
-    if not name:
-        return name
-    lower = name.lower().strip()
-    return ARCHETYPE_ALIASES.get(lower, name)
+def canonical_archetype_sql(column):
+    """
+    SQL expression for the canonical archetype of an opp_deck value: the alias
+    table entry for its lowercased/trimmed form, else the name itself ('' -> NULL).
+    """
+    return f"""COALESCE(
+        (SELECT a.canonical FROM archetype_aliases a WHERE a.alias = LOWER(TRIM({column}))),
+        NULLIF({column}, '')
+    )"""
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Archetype Detection - Signature Cards for Each Deck Type
@@ -243,620 +478,2696 @@ ARCHETYPES = {
     }
 }
 
-def detect_archetype(cards_seen):
+class ArchetypeMatcher:
     """
-    Score each archetype based on cards seen.
-    Returns list of (archetype, score, confidence) sorted by score.
+    Compiled form of ARCHETYPES for detect_archetype. Every card gets an integer
+    id, each archetype a signature and a supporting bitmask over those ids, and
+    an inverted index maps each card to the archetypes that list it, so scoring
+    is a few popcounts over only the archetypes the seen cards touch.
     """
-    if not cards_seen:
-        return []
-    
-    cards_set = set(cards_seen)
-    scores = []
     
-    for archetype, data in ARCHETYPES.items():
-        score = 0
-        signature_hits = 0
-        supporting_hits = 0
+    def __init__(self, archetypes, card_list):
+        self.source = archetypes
+        self.card_bits = {}       # card name -> 1 << card id
+        self.card_archetypes = {} # card name -> bitmask of archetype indexes
+        self.archetypes = []      # (name, signature_mask, supporting_mask, weight, signature_count)
         
-        # Signature cards are worth more
-        for card in data["signature"]:
-            if card in cards_set:
-                score += 10
-                signature_hits += 1
+        for card in card_list:
+            self._card_bit(card)
         
-        # Supporting cards add smaller bonus
-        for card in data["supporting"]:
-            if card in cards_set:
-                score += 3
-                supporting_hits += 1
+        for index, (name, data) in enumerate(archetypes.items()):
+            signature_mask = 0
+            supporting_mask = 0
+            for card in data["signature"]:
+                signature_mask |= self._card_bit(card)
+                self.card_archetypes[card] = self.card_archetypes.get(card, 0) | (1 << index)
+            for card in data["supporting"]:
+                supporting_mask |= self._card_bit(card)
+                self.card_archetypes[card] = self.card_archetypes.get(card, 0) | (1 << index)
+            self.archetypes.append((name, signature_mask, supporting_mask, data["weight"], len(data["signature"])))
+    
+    def _card_bit(self, card):
+        if card not in self.card_bits:
+            self.card_bits[card] = 1 << len(self.card_bits)
+        return self.card_bits[card]
+    
+    def _hits(self, cards_seen):
+        """(score, archetype, signature_hits, supporting_hits, signature_count) per hit, in ARCHETYPES order"""
+        hits = []
+        seen = 0
+        touched = 0
+        for card in cards_seen:
+            archetype_mask = self.card_archetypes.get(card)
+            if archetype_mask:
+                seen |= self.card_bits[card]
+                touched |= archetype_mask
         
-        # Apply archetype weight
-        score *= data["weight"]
+        while touched:
+            lowest = touched & -touched
+            touched ^= lowest
+            name, signature_mask, supporting_mask, weight, signature_count = self.archetypes[lowest.bit_length() - 1]
+            
+            signature_hits = (seen & signature_mask).bit_count()
+            supporting_hits = (seen & supporting_mask).bit_count()
+            
+            # Signature cards are worth more, supporting cards add smaller bonus
+            score = (signature_hits * 10 + supporting_hits * 3) * weight
+            if score > 0:
+                hits.append((score, name, signature_hits, supporting_hits, signature_count))
+        return hits
+    
+    @staticmethod
+    def _confidence(signature_hits, signature_count):
+        # Confidence is based on signature card coverage
+        return round((signature_hits / signature_count) * 100) if signature_count > 0 else 0
+    
+    def score(self, cards_seen):
+        scores = [{
+            "archetype": name,
+            "score": score,
+            "confidence": self._confidence(signature_hits, signature_count),
+            "signature_hits": signature_hits,
+            "supporting_hits": supporting_hits
+        } for score, name, signature_hits, supporting_hits, signature_count in self._hits(cards_seen)]
         
-        # Calculate confidence based on signature card coverage
-        if len(data["signature"]) > 0:
-            confidence = (signature_hits / len(data["signature"])) * 100
-        else:
-            confidence = 0
-        
-        if score > 0:
-            scores.append({
-                "archetype": archetype,
-                "score": score,
-                "confidence": round(confidence),
-                "signature_hits": signature_hits,
-                "supporting_hits": supporting_hits
-            })
-    
-    # Sort by score descending
-    scores.sort(key=lambda x: x["score"], reverse=True)
-    return scores
+        # Sort by score descending (stable, so ties keep ARCHETYPES order)
+        scores.sort(key=lambda x: x["score"], reverse=True)
+        return scores
+    
+    def best(self, cards_seen):
+        """(archetype, score, confidence) of the top entry score() would return, or None"""
+        top = None
+        for hit in self._hits(cards_seen):
+            if top is None or hit[0] > top[0]:
+                top = hit
+        if top is None:
+            return None
+        score, name, signature_hits, _, signature_count = top
+        return name, score, self._confidence(signature_hits, signature_count)
+
+_archetype_matcher = None
+
+def rebuild_archetype_matcher():
+    """Recompile the matcher; call after mutating ARCHETYPES in place"""
+    global _archetype_matcher
+    _archetype_matcher = ArchetypeMatcher(ARCHETYPES, CARD_LIST)
+    return _archetype_matcher
+
+def get_archetype_matcher():
+    # Rebuilds automatically when ARCHETYPES is reassigned
+    if _archetype_matcher is None or _archetype_matcher.source is not ARCHETYPES:
+        return rebuild_archetype_matcher()
+    return _archetype_matcher
+
+def detect_archetype(cards_seen):
+    """
+    Score each archetype based on cards seen.
+    Returns list of (archetype, score, confidence) sorted by score.
+    """
+    if not cards_seen:
+        return []
+    return get_archetype_matcher().score(cards_seen)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Database Helpers
 # ─────────────────────────────────────────────────────────────────────────────
 
-def get_db():
-    conn = psycopg.connect(DATABASE_URL, row_factory=dict_row)
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+# Pool sizing - override per deployment via environment
+DB_POOL_MIN_SIZE = _env_int("DB_POOL_MIN_SIZE", 1)
+DB_POOL_MAX_SIZE = _env_int("DB_POOL_MAX_SIZE", 10)
+DB_POOL_MAX_IDLE = _env_float("DB_POOL_MAX_IDLE", 300.0)      # seconds before an idle connection is closed
+DB_POOL_TIMEOUT = _env_float("DB_POOL_TIMEOUT", 30.0)         # seconds to wait for a free connection
+DB_POOL_CHECK = os.environ.get("DB_POOL_CHECK", "1") != "0"   # health-check connections before handing out
+# Request threads per gunicorn worker; the default must match the Procfile's
+GUNICORN_THREADS = _env_int("GUNICORN_THREADS", 16)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Process-wide connection pool, created lazily so each gunicorn worker gets its own"""
+    global _pool
+    if _pool is not None:
+        return _pool
+    # Threaded workers may race to create it on their first requests
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                max_idle=DB_POOL_MAX_IDLE,
+                timeout=DB_POOL_TIMEOUT,
+                check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+                kwargs={"row_factory": dict_row, "cursor_factory": InstrumentedCursor if METRICS_ENABLED else psycopg.Cursor},
+                name="vibes",
+                open=True,
+            )
+    return _pool
+
+# SQLite: WAL so readers never block the writer, and a page cache sized for analytics
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",          # durable across app crashes; fsyncs at checkpoints
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA cache_size = -65536",           # 64 MB
+    "PRAGMA mmap_size = 268435456",         # 256 MB
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA case_sensitive_like = ON",      # LIKE behaves as in PostgreSQL
+)
+
+_sqlite_local = threading.local()
+
+def sqlite_timestamp(value):
+    """SQLite stores instants as UTC text in CURRENT_TIMESTAMP's format, so they sort and compare"""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+sqlite3.register_adapter(datetime, sqlite_timestamp)
+sqlite3.register_adapter(date, date.isoformat)
+
+def sqlite_local_day(value, zone):
+    """local_day(timestamp, zone) in SQL: the calendar day (YYYY-MM-DD) of an instant in zone"""
+    return as_datetime(value).astimezone(ZoneInfo(zone)).date().isoformat() if value else None
+
+def sqlite_lower(value):
+    """lower() in SQL with full Unicode case mapping, like PostgreSQL's (SQLite's only folds ASCII)"""
+    return value.lower() if isinstance(value, str) else value
+
+def sqlite_dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def sqlite_connection():
+    """This thread's SQLite connection, opened on first use"""
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=DB_POOL_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite_dict_row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("local_day", 2, sqlite_local_day, deterministic=True)
+        conn.create_function("lower", 1, sqlite_lower, deterministic=True)
+        _sqlite_local.conn = conn
     return conn
 
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Main matches table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS matches(
-            id SERIAL PRIMARY KEY,
-            date_time TEXT,
-            my_deck TEXT,
-            opp_name TEXT,
-            opp_deck TEXT,
-            result_match INTEGER,
-            on_play_start INTEGER,
-            notes TEXT
-        );
-    """)
-    
-    # Cards seen per match
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS cards_seen(
-            id SERIAL PRIMARY KEY,
-            match_id INTEGER REFERENCES matches(id) ON DELETE CASCADE,
-            card_name TEXT
-        );
-    """)
-    
-    # User's decklists
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS decklists(
-            id SERIAL PRIMARY KEY,
-            name TEXT,
-            cards TEXT,
-            created_at TEXT,
-            is_public INTEGER DEFAULT 0
-        );
-    """)
-    
-    # Create indexes if they don't exist
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_dt ON matches(date_time);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_my ON matches(my_deck);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_cards_match ON cards_seen(match_id);")
+class SQLiteCursor:
+    """
+    sqlite3 cursor with the psycopg calling conventions the routes use:
+    %s placeholders, dict rows, execute/executemany/fetch*.
+    """
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+    
+    def execute(self, query, params=None):
+        sql = query.replace("%s", "?").replace("%%", "%")
+        if not METRICS_ENABLED:
+            self._cursor.execute(sql, params or ())
+            return self
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params or ())
+        finally:
+            metrics.record_query(query, time.perf_counter() - start, max(self._cursor.rowcount, 0))
+        return self
+    
+    def executemany(self, query, params_seq):
+        self._cursor.executemany(query.replace("%s", "?").replace("%%", "%"), params_seq)
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    @property
+    def description(self):
+        return self._cursor.description
+    
+    # sqlite3 leaves rowcount at -1 for SELECT, so rows are counted as they are read
+    def _counted(self, rows):
+        if METRICS_ENABLED:
+            metrics.record_rows(len(rows))
+        return rows
+    
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if METRICS_ENABLED and row is not None:
+            metrics.record_rows(1)
+        return row
+    
+    def fetchmany(self, size):
+        return self._counted(self._cursor.fetchmany(size))
+    
+    def fetchall(self):
+        return self._counted(self._cursor.fetchall())
+    
+    def __iter__(self):
+        while rows := self.fetchmany(1000):
+            yield from rows
+    
+    def close(self):
+        self._cursor.close()
 
-def now_iso():
-    return datetime.now().strftime("%Y-%m-%d %H:%M")
+@contextmanager
+def sqlite_transaction():
+    conn = sqlite_connection()
+    if conn.in_transaction:
+        # Nested use joins the enclosing transaction
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Routes - Pages
-# ─────────────────────────────────────────────────────────────────────────────
+@contextmanager
+def get_db():
+    """
+    Borrow a pooled connection. Commits when the block exits cleanly, rolls back
+    if it raises, and always returns the connection to the pool.
+    """
+    if USE_SQLITE:
+        with sqlite_transaction() as conn:
+            yield conn
+        return
+    if not METRICS_ENABLED:
+        with get_pool().connection() as conn:
+            yield conn
+        return
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        metrics.record_pool_wait(time.perf_counter() - start)
+        yield conn
 
-@app.route("/")
-def index():
-    return render_template("index.html")
+def new_cursor(conn):
+    return SQLiteCursor(conn) if USE_SQLITE else conn.cursor()
+
+@contextmanager
+def db_cursor():
+    """Borrow a pooled connection and yield a cursor on it (see get_db)"""
+    with get_db() as conn:
+        cur = new_cursor(conn)
+        try:
+            yield cur
+        finally:
+            cur.close()
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Routes - Card List & Archetype Detection
+# SQL Dialect - The few constructs that differ between PostgreSQL and SQLite
 # ─────────────────────────────────────────────────────────────────────────────
 
-@app.route("/api/cards")
-def get_cards():
-    """Return all card names for autocomplete"""
-    return jsonify(sorted(CARD_LIST))
+ID_COLUMN = "INTEGER PRIMARY KEY AUTOINCREMENT" if USE_SQLITE else "SERIAL PRIMARY KEY"
+TIMESTAMP_TYPE = "TEXT" if USE_SQLITE else "TIMESTAMPTZ"
+DATE_TYPE = "TEXT" if USE_SQLITE else "DATE"
+JSON_TYPE = "TEXT" if USE_SQLITE else "JSONB"
+# Code-point order (SQLite's default), so prefix ranges line up with an index
+BINARY_COLLATE = "" if USE_SQLITE else ' COLLATE "C"'
 
-@app.route("/api/archetypes")
-def get_archetypes():
-    """Return all archetype names"""
-    return jsonify(sorted(ARCHETYPES.keys()))
+def list_param(values):
+    """Bind a Python list for sql_in_list / sql_list_table"""
+    return json.dumps(list(values), default=sqlite_timestamp) if USE_SQLITE else list(values)
 
-@app.route("/api/detect-archetype", methods=["POST"])
-def detect_archetype_api():
-    """Detect archetype from list of cards seen"""
-    cards = request.json.get("cards", [])
-    results = detect_archetype(cards)
-    return jsonify(results)
+def sql_in_list(expr, pg_type="text"):
+    """expr is in a list parameter (bind it with list_param)"""
+    if USE_SQLITE:
+        return f"{expr} IN (SELECT value FROM json_each(%s))"
+    return f"{expr} = ANY(%s::{pg_type}[])"
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Routes - Matches API
-# ─────────────────────────────────────────────────────────────────────────────
+def sql_list_table(alias, pg_type="text"):
+    """A list parameter as a FROM item with one column, alias.value (bind it with list_param)"""
+    if USE_SQLITE:
+        return f"json_each(%s) AS {alias}"
+    return f"unnest(%s::{pg_type}[]) AS {alias}(value)"
 
-@app.route("/api/matches", methods=["GET"])
-def get_matches():
-    conn = get_db()
-    cur = conn.cursor()
-    
-    query = """
-        SELECT id, date_time, my_deck, opp_name, opp_deck, 
-               result_match, on_play_start, notes 
-        FROM matches WHERE 1=1
-    """
-    params = []
-    
-    if request.args.get("date_from"):
-        query += " AND date_time >= %s"
-        params.append(request.args.get("date_from") + " 00:00")
-    if request.args.get("date_to"):
-        query += " AND date_time <= %s"
-        params.append(request.args.get("date_to") + " 23:59")
-    if request.args.get("my_deck"):
-        query += " AND my_deck LIKE %s"
-        params.append("%" + request.args.get("my_deck") + "%")
-    if request.args.get("opp_deck"):
-        query += " AND opp_deck LIKE %s"
-        params.append("%" + request.args.get("opp_deck") + "%")
-    if request.args.get("result") == "win":
-        query += " AND result_match = 1"
-    elif request.args.get("result") == "loss":
-        query += " AND result_match = 0"
-    
-    query += " ORDER BY date_time DESC, id DESC"
-    
-    cur.execute(query, params)
-    matches = [dict(row) for row in cur.fetchall()]
-    
-    # Get cards seen for each match
-    for match in matches:
-        cur.execute(
-            "SELECT card_name FROM cards_seen WHERE match_id = %s",
-            (match["id"],)
-        )
-        cards = cur.fetchall()
-        match["cards_seen"] = [c["card_name"] for c in cards]
-    
-    cur.close()
-    conn.close()
-    return jsonify(matches)
+def sql_distinct(a, b):
+    """NULL-safe inequality"""
+    return f"{a} IS NOT {b}" if USE_SQLITE else f"{a} IS DISTINCT FROM {b}"
 
-@app.route("/api/matches", methods=["POST"])
-def add_match():
-    data = request.json
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        INSERT INTO matches (date_time, my_deck, opp_name, opp_deck, result_match, on_play_start, notes)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-    """, (
-        now_iso(),
-        data.get("my_deck", ""),
-        data.get("opp_name", ""),
-        data.get("opp_deck", ""),
-        1 if data.get("result") == "win" else 0,
-        data.get("on_play"),
-        data.get("notes", "")
-    ))
-    
-    match_id = cur.fetchone()["id"]
-    
-    # Insert cards seen
-    cards_seen = data.get("cards_seen", [])
-    for card in cards_seen:
-        cur.execute(
-            "INSERT INTO cards_seen (match_id, card_name) VALUES (%s, %s)",
-            (match_id, card)
-        )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
-    return jsonify({"success": True, "id": match_id})
+def sql_older_than(column, interval):
+    """column is before now minus an interval like '1 day'"""
+    if USE_SQLITE:
+        return f"{column} < datetime('now', '-{interval}')"
+    return f"{column} < now() - interval '{interval}'"
 
-@app.route("/api/matches/<int:match_id>", methods=["DELETE"])
-def delete_match(match_id):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM cards_seen WHERE match_id = %s", (match_id,))
-    cur.execute("DELETE FROM matches WHERE id = %s", (match_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-    return jsonify({"success": True})
+def sql_local_day(column):
+    """Calendar day of a timestamp in the zone bound to the next parameter"""
+    if USE_SQLITE:
+        return f"local_day({column}, %s)"
+    return f"(({column}) AT TIME ZONE %s)::date"
 
-@app.route("/api/matches/<int:match_id>/cards", methods=["POST"])
-def add_card_to_match(match_id):
-    """Add a card to an existing match"""
-    card_name = request.json.get("card_name")
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO cards_seen (match_id, card_name) VALUES (%s, %s)",
-        (match_id, card_name)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-    return jsonify({"success": True})
+def sql_card_list(match_id):
+    """A match's [card_id, quantity] pairs in sighting order (decode the value with card_list)"""
+    if USE_SQLITE:
+        return f"""(SELECT json_group_array(json_array(card_id, quantity)) FROM (
+            SELECT card_id, quantity FROM cards_seen WHERE match_id = {match_id} ORDER BY position))"""
+    return f"""(SELECT json_agg(json_build_array(card_id, quantity) ORDER BY position)
+        FROM cards_seen WHERE match_id = {match_id})"""
 
-@app.route("/api/matches/<int:match_id>/cards/<card_name>", methods=["DELETE"])
-def remove_card_from_match(match_id, card_name):
-    """Remove a card from a match"""
-    conn = get_db()
-    cur = conn.cursor()
+def card_list(cur, value):
+    """Card names, one per copy seen, from a sql_card_list value (misses are looked up through cur)"""
+    pairs = json.loads(value) if isinstance(value, str) else value or []
+    names = card_names(cur, (card_id for card_id, _ in pairs))
+    return [names[card_id] for card_id, quantity in pairs for _ in range(quantity)]
+
+def json_param(value):
+    return json.dumps(value) if USE_SQLITE else Jsonb(value)
+
+def json_value(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+def table_columns(cur, table):
+    """Column names of table (empty if it doesn't exist)"""
+    if USE_SQLITE:
+        cur.execute(f"PRAGMA table_info({table})")
+    else:
+        cur.execute("""
+            SELECT column_name as name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+        """, (table,))
+    return {row["name"] for row in cur.fetchall()}
+
+def add_column(cur, table, column, definition):
+    if column not in table_columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def bulk_insert(cur, table, columns, rows):
+    """Load rows with COPY on PostgreSQL, one executemany on SQLite"""
+    if USE_SQLITE:
+        placeholders = ", ".join(["%s"] * len(columns))
+        cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+def reserve_match_ids(cur, count):
+    """Ids for count new matches, so their cards can be written in the same pass"""
+    if USE_SQLITE:
+        cur.execute("""
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'matches'), 0),
+                       COALESCE((SELECT MAX(id) FROM matches), 0)) as last_id
+        """)
+        last_id = cur.fetchone()["last_id"]
+        return list(range(last_id + 1, last_id + 1 + count))
     cur.execute(
-        "DELETE FROM cards_seen WHERE id = (SELECT id FROM cards_seen WHERE match_id = %s AND card_name = %s LIMIT 1)",
-        (match_id, card_name)
+        "SELECT nextval(pg_get_serial_sequence('matches', 'id')) as id FROM generate_series(1, %s)",
+        (count,)
     )
-    conn.commit()
-    cur.close()
-    conn.close()
-    return jsonify({"success": True})
+    return [row["id"] for row in cur.fetchall()]
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Routes - Stats & Analytics
+# Timestamps - matches.date_time is an instant; days are cut in the viewer's zone
 # ─────────────────────────────────────────────────────────────────────────────
 
-@app.route("/api/stats")
-def get_stats():
-    conn = get_db()
-    cur = conn.cursor()
-    
-    my_deck = request.args.get("my_deck")
-    date_from = request.args.get("date_from")
-    date_to = request.args.get("date_to")
-    
-    where_clauses = []
-    params = []
-    
-    if my_deck:
-        where_clauses.append("my_deck = %s")
-        params.append(my_deck)
-    if date_from:
-        where_clauses.append("date_time >= %s")
-        params.append(date_from + " 00:00")
-    if date_to:
-        where_clauses.append("date_time <= %s")
-        params.append(date_to + " 23:59")
-    
-    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-    
-    # Overall stats
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql}", params)
-    total = cur.fetchone()["count"]
-    
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql} AND result_match = 1", params)
-    wins = cur.fetchone()["count"]
-    
-    # Play/Draw stats
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql} AND on_play_start = 1", params)
-    otp_total = cur.fetchone()["count"]
-    
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql} AND on_play_start = 1 AND result_match = 1", params)
-    otp_wins = cur.fetchone()["count"]
-    
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql} AND on_play_start = 0", params)
-    otd_total = cur.fetchone()["count"]
-    
-    cur.execute(f"SELECT COUNT(*) as count FROM matches WHERE {where_sql} AND on_play_start = 0 AND result_match = 1", params)
-    otd_wins = cur.fetchone()["count"]
-    
-    # Matchup breakdown
-    matchups_query = f"""
-        SELECT opp_deck, 
-               COUNT(*) as total,
-               SUM(CASE WHEN result_match = 1 THEN 1 ELSE 0 END) as wins
-        FROM matches 
-        WHERE {where_sql} AND opp_deck != ''
-        GROUP BY opp_deck
-        ORDER BY total DESC
-    """
-    cur.execute(matchups_query, params)
-    matchup_rows = cur.fetchall()
-    matchups = []
-    for row in matchup_rows:
-        matchups.append({
-            "opp_deck": row["opp_deck"],
-            "total": row["total"],
-            "wins": row["wins"],
-            "losses": row["total"] - row["wins"],
-            "win_rate": round(row["wins"] / row["total"] * 100, 1) if row["total"] > 0 else 0
-        })
-    
-    cur.close()
-    conn.close()
-    
-    return jsonify({
-        "total": total,
-        "wins": wins,
-        "losses": total - wins,
-        "win_rate": round(wins / total * 100, 1) if total > 0 else 0,
-        "otp_total": otp_total,
-        "otp_wins": otp_wins,
-        "otp_win_rate": round(otp_wins / otp_total * 100, 1) if otp_total > 0 else 0,
-        "otd_total": otd_total,
-        "otd_wins": otd_wins,
-        "otd_win_rate": round(otd_wins / otd_total * 100, 1) if otd_total > 0 else 0,
-        "matchups": matchups
-    })
+def zone_named(name):
+    """ZoneInfo for an IANA name like Europe/Berlin; raises ValueError if unknown"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone {name!r}")
 
-@app.route("/api/analytics/cards-in-losses")
-def cards_in_losses():
-    """Cards most commonly seen in losses"""
-    conn = get_db()
-    cur = conn.cursor()
-    my_deck = request.args.get("my_deck")
-    
-    query = """
-        SELECT cs.card_name, COUNT(*) as count
-        FROM cards_seen cs
-        JOIN matches m ON cs.match_id = m.id
-        WHERE m.result_match = 0
-    """
-    params = []
-    
-    if my_deck:
-        query += " AND m.my_deck = %s"
-        params.append(my_deck)
-    
-    query += " GROUP BY cs.card_name ORDER BY count DESC LIMIT 20"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{"card": r["card_name"], "count": r["count"]} for r in rows])
+def request_zone():
+    """The viewer's zone from ?tz=, else APP_TIMEZONE"""
+    return zone_named(request.args.get("tz") or APP_TIMEZONE)
 
-@app.route("/api/analytics/cards-in-wins")
-def cards_in_wins():
-    """Cards most commonly seen in wins"""
-    conn = get_db()
-    cur = conn.cursor()
-    my_deck = request.args.get("my_deck")
-    
-    query = """
-        SELECT cs.card_name, COUNT(*) as count
-        FROM cards_seen cs
-        JOIN matches m ON cs.match_id = m.id
-        WHERE m.result_match = 1
-    """
-    params = []
-    
-    if my_deck:
-        query += " AND m.my_deck = %s"
-        params.append(my_deck)
-    
-    query += " GROUP BY cs.card_name ORDER BY count DESC LIMIT 20"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    return jsonify([{"card": r["card_name"], "count": r["count"]} for r in rows])
+def utc_now():
+    # Whole seconds, which is what SQLite's text timestamps keep
+    return datetime.now(timezone.utc).replace(microsecond=0)
 
-@app.route("/api/analytics/winrate-vs-card")
-def winrate_vs_card():
-    """Win rate when opponent plays specific cards"""
-    conn = get_db()
-    cur = conn.cursor()
-    my_deck = request.args.get("my_deck")
-    
-    query = """
-        SELECT cs.card_name,
-               COUNT(*) as total,
-               SUM(CASE WHEN m.result_match = 1 THEN 1 ELSE 0 END) as wins
-        FROM cards_seen cs
-        JOIN matches m ON cs.match_id = m.id
+def as_datetime(value):
+    """Aware UTC datetime from a timestamp column (SQLite returns UTC text)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def iso_timestamp(value):
+    """ISO 8601 (UTC) for JSON responses"""
+    return as_datetime(value).isoformat() if value is not None else None
+
+def parse_local_time(text, zone):
+    """'YYYY-MM-DD HH:MM' wall-clock time in zone; raises ValueError if malformed"""
+    return datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=zone)
+
+def day_start(day, zone):
+    """Midnight in zone at the start of day (YYYY-MM-DD); raises ValueError if malformed"""
+    try:
+        return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=zone)
+    except ValueError:
+        raise ValueError(f"Invalid date {day!r} (expected YYYY-MM-DD)")
+
+def as_date(value):
+    """date from a DATE column or a local_day() value (SQLite returns text)"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def request_date_range(zone=None):
+    """
+    (start, end) instants for ?date_from=&date_to= (inclusive days, either
+    optional) in zone, by default the viewer's; raises ValueError on a bad date or zone.
     """
+    zone = zone or request_zone()
+    start = end = None
+    if request.args.get("date_from"):
+        start = day_start(request.args.get("date_from"), zone)
+    if request.args.get("date_to"):
+        # Wall-clock arithmetic, so the day ends at local midnight across DST changes
+        end = day_start(request.args.get("date_to"), zone) + timedelta(days=1)
+    return start, end
+
+def date_range_sql(column, start, end):
+    """WHERE clauses and params for start <= column < end (either bound may be None)"""
+    clauses = []
     params = []
-    
-    if my_deck:
-        query += " WHERE m.my_deck = %s"
-        params.append(my_deck)
-    
-    query += " GROUP BY cs.card_name HAVING COUNT(*) >= 3 ORDER BY COUNT(*) DESC"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    results = []
-    for r in rows:
-        results.append({
-            "card": r["card_name"],
-            "total": r["total"],
-            "wins": r["wins"],
-            "losses": r["total"] - r["wins"],
-            "win_rate": round(r["wins"] / r["total"] * 100, 1)
-        })
-    
-    return jsonify(results)
+    if start:
+        clauses.append(f"{column} >= %s")
+        params.append(start)
+    if end:
+        clauses.append(f"{column} < %s")
+        params.append(end)
+    return clauses, params
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Routes - Meta Decklist Aggregation
-# ─────────────────────────────────────────────────────────────────────────────
+# Stand-in for legacy date_time text with no readable date, so every match keeps a sortable time
+UNKNOWN_MATCH_TIME = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-@app.route("/api/meta/decklists")
-def get_meta_decklists():
+def legacy_match_time(text, zone):
     """
-    Aggregate cards seen per opponent deck archetype to estimate decklists.
-    Only shows archetypes with 5+ matches. Normalizes similar archetype names.
+    Instant for a legacy date_time value read in zone: the full 'YYYY-MM-DD HH:MM',
+    else midnight of a leading date, else UNKNOWN_MATCH_TIME.
     """
-    conn = get_db()
-    cur = conn.cursor()
+    text = (text or "").strip()
+    try:
+        return parse_local_time(text, zone)
+    except ValueError:
+        pass
+    try:
+        return day_start(text[:10], zone)
+    except ValueError:
+        return UNKNOWN_MATCH_TIME
+
+def migrate_match_timestamps(cur):
+    """
+    Convert text date_time values ('YYYY-MM-DD HH:MM', written in server-local
+    time) to instants, reading them in APP_TIMEZONE; unreadable ones are repaired
+    by legacy_match_time() rather than left NULL. Returns rows converted.
+    """
+    zone = zone_named(APP_TIMEZONE)
+    if USE_SQLITE:
+        # Column types can't change in place; converted values are 'YYYY-MM-DD HH:MM:SS',
+        # so anything else (and NULLs left by earlier versions) is left to convert
+        cur.execute("SELECT id, date_time FROM matches WHERE date_time IS NULL OR length(date_time) != 19")
+        rows = [(legacy_match_time(row["date_time"], zone), row["id"]) for row in cur.fetchall()]
+        cur.executemany("UPDATE matches SET date_time = %s WHERE id = %s", rows)
+        return len(rows)
     
-    # Get all matches with their archetypes
     cur.execute("""
-        SELECT id, opp_deck FROM matches 
-        WHERE opp_deck != '' AND opp_deck IS NOT NULL
+        SELECT data_type, is_nullable FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'matches' AND column_name = 'date_time'
     """)
-    all_matches = cur.fetchall()
-    
-    # Group by normalized archetype
-    archetype_matches = {}
-    for match in all_matches:
-        normalized = normalize_archetype(match["opp_deck"])
-        if normalized not in archetype_matches:
-            archetype_matches[normalized] = []
-        archetype_matches[normalized].append(match["id"])
+    column = cur.fetchone()
+    if column["data_type"] == "text":
+        # Rewrite the values the cast below can't read as the text of their repaired time
+        cur.execute("SELECT id, date_time FROM matches")
+        repairs = []
+        for row in cur.fetchall():
+            try:
+                parse_local_time(row["date_time"] or "", zone)
+            except ValueError:
+                repaired = legacy_match_time(row["date_time"], zone).astimezone(zone)
+                repairs.append((repaired.strftime("%Y-%m-%d %H:%M"), row["id"]))
+        cur.executemany("UPDATE matches SET date_time = %s WHERE id = %s", repairs)
+        # DDL takes no bind parameters; zone_named() already vetted the name
+        cur.execute(f"""
+            ALTER TABLE matches ALTER COLUMN date_time TYPE TIMESTAMPTZ
+            USING date_time::timestamp AT TIME ZONE '{zone.key}'
+        """)
+        cur.execute("SELECT COUNT(*) as n FROM matches")
+        converted = cur.fetchone()["n"]
+    else:
+        # NULLs left by earlier versions of this migration
+        cur.execute("UPDATE matches SET date_time = %s WHERE date_time IS NULL", (UNKNOWN_MATCH_TIME,))
+        converted = cur.rowcount
+    if column["is_nullable"] == "YES":
+        cur.execute("ALTER TABLE matches ALTER COLUMN date_time SET NOT NULL")
+    return converted
+
+def init_db():
     
-    result = []
-    
-    for archetype_name, match_ids in archetype_matches.items():
-        match_count = len(match_ids)
+    with db_cursor() as cur:
+        # Main matches table
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS matches(
+                id {ID_COLUMN},
+                date_time {TIMESTAMP_TYPE} NOT NULL,
+                my_deck TEXT,
+                opp_name TEXT,
+                opp_deck TEXT,
+                result_match INTEGER,
+                on_play_start INTEGER,
+                notes TEXT
+            );
+        """)
         
-        if match_count < 5:
-            continue
+        # Bumps data_version once that table exists, below
+        timestamps_migrated = migrate_match_timestamps(cur)
         
-        # Get all cards seen against this archetype with frequency
-        placeholders = ','.join(['%s'] * len(match_ids))
+        # Card names, seeded from CARD_LIST; unknown names are added as they are seen
         cur.execute(f"""
-            SELECT cs.card_name, COUNT(*) as times_seen,
-                   COUNT(DISTINCT m.id) as matches_appeared
-            FROM cards_seen cs
-            JOIN matches m ON cs.match_id = m.id
-            WHERE m.id IN ({placeholders})
-            GROUP BY cs.card_name
-            ORDER BY matches_appeared DESC, times_seen DESC
-        """, match_ids)
+            CREATE TABLE IF NOT EXISTS cards(
+                id {ID_COLUMN},
+                name TEXT NOT NULL UNIQUE
+            );
+        """)
+        card_ids(cur, CARD_LIST)
         
-        cards_data = cur.fetchall()
+        # Before card ids, cards_seen held one row per sighting keyed by card name
+        migrating = "card_name" in table_columns(cur, "cards_seen")
+        if migrating:
+            fold_legacy_cards_seen(cur)
         
-        if not cards_data:
-            continue
+        # Cards seen per match: copies seen, and the order each card was first seen in
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS cards_seen(
+                match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+                card_id INTEGER NOT NULL REFERENCES cards(id),
+                quantity SMALLINT NOT NULL,
+                position SMALLINT NOT NULL,
+                PRIMARY KEY (match_id, card_id)
+            ) {"WITHOUT ROWID" if USE_SQLITE else ""};
+        """)
+        if migrating:
+            cur.execute("""
+                INSERT INTO cards_seen (match_id, card_id, quantity, position)
+                SELECT match_id, card_id, quantity, position FROM cards_seen_migrated
+            """)
+            app.logger.info("Migrated cards_seen to card ids: %d rows", cur.rowcount)
+            cur.execute("DROP TABLE cards_seen_migrated")
         
-        # Calculate appearance rate and build estimated decklist
-        estimated_deck = []
-        total_cards = 0
+        # User's decklists
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS decklists(
+                id {ID_COLUMN},
+                name TEXT,
+                cards TEXT,
+                created_at TEXT,
+                is_public INTEGER DEFAULT 0
+            );
+        """)
         
-        for card in cards_data:
-            card_name = card["card_name"]
-            times_seen = card["times_seen"]
-            matches_appeared = card["matches_appeared"]
-            
-            # Appearance rate = % of matches this card appeared in
-            appearance_rate = round(matches_appeared / match_count * 100, 1)
-            
-            # Estimate copies based on average times seen per match it appeared
-            avg_copies = times_seen / matches_appeared if matches_appeared > 0 else 0
-            
-            # Round to likely deck count (1-4)
-            if avg_copies >= 3.5:
-                estimated_copies = 4
-            elif avg_copies >= 2.5:
-                estimated_copies = 3
-            elif avg_copies >= 1.5:
-                estimated_copies = 2
+        # Alias -> canonical archetype name, used to fill matches.opp_archetype
+        seed_aliases = not table_columns(cur, "archetype_aliases")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS archetype_aliases(
+                alias TEXT PRIMARY KEY,
+                canonical TEXT NOT NULL
+            );
+        """)
+        
+        # Canonical opponent archetype, maintained on write
+        add_column(cur, "matches", "opp_archetype", "TEXT")
+        
+        # Top detect_archetype() result for the cards seen, kept next to opp_deck
+        add_column(cur, "matches", "detected_archetype", "TEXT")
+        add_column(cur, "matches", "detected_score", "INTEGER")
+        add_column(cur, "matches", "detected_confidence", "INTEGER")
+        
+        # Card sightings rolled up by archetype/deck/result/play, maintained on write.
+        # Unknown archetype is stored as '' and unknown play/draw as -1.
+        if "card_name" in table_columns(cur, "card_rollup"):
+            # Keyed by name before card ids; rebuilt below
+            cur.execute("DROP TABLE card_rollup")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS card_rollup(
+                opp_archetype TEXT NOT NULL,
+                my_deck TEXT NOT NULL,
+                card_id INTEGER NOT NULL,
+                result_match INTEGER NOT NULL,
+                on_play_start INTEGER NOT NULL,
+                times_seen INTEGER NOT NULL,
+                matches INTEGER NOT NULL,
+                PRIMARY KEY (opp_archetype, my_deck, card_id, result_match, on_play_start)
+            );
+        """)
+        
+        # Replaced by the daily tables below
+        cur.execute("DROP TABLE IF EXISTS hourly_rollup")
+        
+        # Match counts per day in APP_TIMEZONE and deck, maintained on write (see query_trends).
+        # Opponent archetype share is kept apart so the record doesn't fan out by archetype.
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS daily_rollup(
+                day {DATE_TYPE} NOT NULL,
+                my_deck TEXT NOT NULL,
+                matches INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                otp_total INTEGER NOT NULL,
+                otp_wins INTEGER NOT NULL,
+                otd_total INTEGER NOT NULL,
+                otd_wins INTEGER NOT NULL,
+                PRIMARY KEY (day, my_deck)
+            );
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS daily_archetypes(
+                day {DATE_TYPE} NOT NULL,
+                my_deck TEXT NOT NULL,
+                opp_archetype TEXT NOT NULL,
+                matches INTEGER NOT NULL,
+                PRIMARY KEY (day, my_deck, opp_archetype)
+            );
+        """)
+        # The zone the daily tables were cut in; they are rebuilt when APP_TIMEZONE changes
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS daily_rollup_zone(
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                zone TEXT NOT NULL
+            );
+        """)
+        
+        # One row per opponent name: latest deck and head-to-head record, maintained on write.
+        # name_key is the lower-cased name, for prefix search.
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS opponents(
+                name TEXT PRIMARY KEY,
+                name_key TEXT{BINARY_COLLATE} NOT NULL,
+                last_deck TEXT,
+                last_played {TIMESTAMP_TYPE},
+                matches INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                losses INTEGER NOT NULL
+            );
+        """)
+        
+        # Responses of already-applied card deltas, for safe client retries
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS idempotency_keys(
+                key TEXT PRIMARY KEY,
+                match_id INTEGER,
+                response {JSON_TYPE},
+                created_at {TIMESTAMP_TYPE} NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Fingerprint of the match and body a key was first used with
+        add_column(cur, "idempotency_keys", "request_hash", "TEXT")
+        
+        # Single-row write counter, bumped by every write (see bump_data_version)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS data_version(
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at {TIMESTAMP_TYPE} NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Bumped only by writes to matches' cards, deck or result (see note_card_pairs)
+        add_column(cur, "data_version", "pairs_version", "BIGINT NOT NULL DEFAULT 0")
+        cur.execute("INSERT INTO data_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING")
+        if timestamps_migrated:
+            bump_data_version(cur)
+        
+        # Create indexes if they don't exist
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_dt_id ON matches(date_time DESC, id DESC);")
+        # Date-range scans within one deck / archetype (the prefixes serve equality lookups)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_my_dt ON matches(my_deck, date_time);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_opp_archetype_dt ON matches(opp_archetype, date_time);")
+        # An opponent's latest match, when deleting refreshes their last deck
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_opp_name_dt ON matches(opp_name, date_time DESC, id DESC);")
+        # Covered by idx_dt_id and the composite indexes above
+        for index in ("idx_dt", "idx_my", "idx_opp_archetype"):
+            cur.execute(f"DROP INDEX IF EXISTS {index}")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_rollup_my ON card_rollup(my_deck);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_opponents_key ON opponents(name_key);")
+        
+        # Seed default aliases once, so ones deleted through the API stay deleted
+        if seed_aliases:
+            cur.executemany("""
+                INSERT INTO archetype_aliases (alias, canonical) VALUES (%s, %s)
+                ON CONFLICT (alias) DO NOTHING
+            """, list(ARCHETYPE_ALIASES.items()))
+            renormalize_archetypes(cur)
+        else:
+            # Backfill rows written before opp_archetype existed
+            renormalize_archetypes(cur, only_missing=True)
+        
+        # First run with existing history: populate the rollups
+        cur.execute("""
+            SELECT EXISTS(SELECT 1 FROM card_rollup) as built, EXISTS(SELECT 1 FROM cards_seen) as has_cards,
+                   EXISTS(SELECT 1 FROM daily_rollup) as days_built, EXISTS(SELECT 1 FROM matches) as has_matches,
+                   EXISTS(SELECT 1 FROM opponents) as opponents_built,
+                   (SELECT zone FROM daily_rollup_zone) as days_zone
+        """)
+        row = cur.fetchone()
+        if row["has_cards"] and not row["built"]:
+            rebuild_card_rollup(cur)
+        # Also after timestamps were converted or repaired, which moves matches between days
+        if timestamps_migrated or row["days_zone"] != APP_TIMEZONE or (row["has_matches"] and not row["days_built"]):
+            rebuild_daily_rollup(cur)
+        if row["has_matches"] and not row["opponents_built"]:
+            rebuild_opponents(cur)
+
+def fold_legacy_cards_seen(cur):
+    """
+    Fold the one-row-per-sighting cards_seen into (match, card, quantity)
+    rows in a temp table, and drop it so init_db can create the new one.
+    """
+    cur.execute("SELECT DISTINCT card_name FROM cards_seen WHERE card_name IS NOT NULL")
+    card_ids(cur, [row["card_name"] for row in cur.fetchall()])
+    cur.execute("""
+        CREATE TEMP TABLE cards_seen_migrated AS
+        SELECT cs.match_id, c.id as card_id, COUNT(*) as quantity,
+               ROW_NUMBER() OVER (PARTITION BY cs.match_id ORDER BY MIN(cs.id)) as position
+        FROM cards_seen cs
+        JOIN cards c ON c.name = cs.card_name
+        JOIN matches m ON m.id = cs.match_id
+        GROUP BY cs.match_id, c.id
+    """)
+    cur.execute("DROP TABLE cards_seen")
+
+# cards.id -> name. Cards are never renamed or deleted, so entries never go stale;
+# reading names here keeps the cards join out of every per-match card list
+_card_names = {}
+_card_names_lock = threading.Lock()
+
+def card_names(cur, ids):
+    """Names for the given card ids, loading the cards table through the caller's cursor on a miss"""
+    ids = set(ids)
+    if ids <= _card_names.keys():
+        return {card_id: _card_names[card_id] for card_id in ids}
+    cur.execute("SELECT id, name FROM cards")
+    found = {row["id"]: row["name"] for row in cur.fetchall()}
+    # Cards this request added may still roll back (and their ids be reused), so they aren't cached
+    uncommitted = g.get("new_card_ids", set()) if has_request_context() else set()
+    with _card_names_lock:
+        _card_names.update((card_id, name) for card_id, name in found.items() if card_id not in uncommitted)
+    return {card_id: found[card_id] for card_id in ids}
+
+def card_ids(cur, names):
+    """Map card names to cards.id, adding names not in the table yet"""
+    names = list(dict.fromkeys(names))
+    query = f"SELECT id, name FROM cards WHERE {sql_in_list('name')}"
+    cur.execute(query, (list_param(names),))
+    ids = {row["name"]: row["id"] for row in cur.fetchall()}
+    missing = [name for name in names if name not in ids]
+    if missing:
+        cur.executemany("INSERT INTO cards (name) VALUES (%s) ON CONFLICT (name) DO NOTHING", [(name,) for name in missing])
+        cur.execute(query, (list_param(missing),))
+        added = {row["name"]: row["id"] for row in cur.fetchall()}
+        ids.update(added)
+        # Not committed yet; card_names keeps these out of the shared cache
+        if has_request_context():
+            g.setdefault("new_card_ids", set()).update(added.values())
+    return ids
+
+CARDS_SEEN_COLUMNS = ("match_id", "card_id", "quantity", "position")
+
+def card_rows(match_id, cards, ids):
+    """cards_seen rows (match_id, card_id, quantity, position) for a list of sightings"""
+    return [
+        (match_id, ids[name], quantity, position)
+        for position, (name, quantity) in enumerate(Counter(cards).items(), start=1)
+    ]
+
+def renormalize_archetypes(cur, aliases=None, only_missing=False):
+    """
+    Recompute matches.opp_archetype from the alias table. Restrict to opp_deck
+    values matching the given aliases, or to rows never normalized. Returns
+    the number of rows changed.
+    """
+    canonical = canonical_archetype_sql("opp_deck")
+    query = f"UPDATE matches SET opp_archetype = {canonical} WHERE {sql_distinct('opp_archetype', canonical)}"
+    params = []
+    if aliases is not None:
+        query += " AND " + sql_in_list("LOWER(TRIM(opp_deck))")
+        params.append(list_param(aliases))
+    if only_missing:
+        query += " AND opp_archetype IS NULL AND opp_deck != ''"
+    
+    if aliases is not None:
+        # Move just the affected matches between archetypes in the rollup
+        match_filter = sql_in_list("LOWER(TRIM(m.opp_deck))")
+        adjust_card_rollup(cur, match_filter, params, -1)
+        adjust_daily_archetypes(cur, match_filter, params, -1)
+        cur.execute(query, params)
+        changed = cur.rowcount
+        adjust_card_rollup(cur, match_filter, params, 1)
+        adjust_daily_archetypes(cur, match_filter, params, 1)
+    else:
+        cur.execute(query, params)
+        changed = cur.rowcount
+        if changed:
+            rebuild_card_rollup(cur)
+            rebuild_daily_rollup(cur)
+    if changed:
+        bump_data_version(cur)
+    return changed
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Card Rollup - Pre-aggregated cards_seen x matches for analytics
+# ─────────────────────────────────────────────────────────────────────────────
+
+ROLLUP_SELECT = """
+    SELECT COALESCE(m.opp_archetype, '') as opp_archetype, COALESCE(m.my_deck, '') as my_deck,
+           cs.card_id, m.result_match, COALESCE(m.on_play_start, -1) as on_play_start,
+           SUM(cs.quantity) as times_seen, COUNT(*) as matches
+    FROM matches m
+    JOIN cards_seen cs ON cs.match_id = m.id
+"""
+
+ROLLUP_GROUP_BY = """
+    GROUP BY COALESCE(m.opp_archetype, ''), COALESCE(m.my_deck, ''), cs.card_id,
+             m.result_match, COALESCE(m.on_play_start, -1)
+"""
+
+def adjust_card_rollup(cur, match_filter, params, sign):
+    """
+    Add (sign=1) or retract (sign=-1) the cards of the matches selected by
+    match_filter (a WHERE clause over matches m) to/from card_rollup. Call
+    with -1 before changing a match and with 1 afterwards, in the same transaction.
+    """
+    cur.execute(f"""
+        INSERT INTO card_rollup AS r
+            (opp_archetype, my_deck, card_id, result_match, on_play_start, times_seen, matches)
+        SELECT k.opp_archetype, k.my_deck, k.card_id, k.result_match, k.on_play_start,
+               k.times_seen * {sign}, k.matches * {sign}
+        FROM ({ROLLUP_SELECT} WHERE {match_filter} {ROLLUP_GROUP_BY}) AS k
+        WHERE true  -- lets SQLite parse ON CONFLICT after a SELECT
+        ON CONFLICT (opp_archetype, my_deck, card_id, result_match, on_play_start) DO UPDATE
+        SET times_seen = r.times_seen + EXCLUDED.times_seen,
+            matches = r.matches + EXCLUDED.matches
+    """, params)
+    if sign < 0:
+        cur.execute("DELETE FROM card_rollup WHERE times_seen <= 0")
+
+def lock_match(cur, match_id):
+    """Serialize rollup maintenance for one match against concurrent edits"""
+    if USE_SQLITE:
+        # No row locks: a no-op write takes the database write lock instead
+        cur.execute("UPDATE matches SET id = id WHERE id = %s", (match_id,))
+        return cur.rowcount > 0
+    cur.execute("SELECT id FROM matches WHERE id = %s FOR UPDATE", (match_id,))
+    return cur.fetchone() is not None
+
+def rebuild_card_rollup(cur):
+    """Recompute card_rollup from scratch"""
+    if not USE_SQLITE:
+        cur.execute("LOCK TABLE card_rollup IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM card_rollup")
+    cur.execute(f"""
+        INSERT INTO card_rollup
+            (opp_archetype, my_deck, card_id, result_match, on_play_start, times_seen, matches)
+        {ROLLUP_SELECT} {ROLLUP_GROUP_BY}
+    """)
+    return cur.rowcount
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Daily Rollup - Pre-aggregated match counts for trends
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Matches with their day in APP_TIMEZONE (bound as the first parameter)
+DAILY_MATCHES = f"""
+    SELECT {sql_local_day("m.date_time")} as day, COALESCE(m.my_deck, '') as my_deck,
+           COALESCE(m.opp_archetype, '') as opp_archetype, m.result_match, m.on_play_start
+    FROM matches m
+    WHERE m.date_time IS NOT NULL
+"""
+
+DAILY_COUNTERS = ("matches", "wins", "otp_total", "otp_wins", "otd_total", "otd_wins")
+
+DAILY_COUNTS = """
+    SELECT k.day, k.my_deck,
+           COUNT(*) as matches,
+           COUNT(*) FILTER (WHERE k.result_match = 1) as wins,
+           COUNT(*) FILTER (WHERE k.on_play_start = 1) as otp_total,
+           COUNT(*) FILTER (WHERE k.on_play_start = 1 AND k.result_match = 1) as otp_wins,
+           COUNT(*) FILTER (WHERE k.on_play_start = 0) as otd_total,
+           COUNT(*) FILTER (WHERE k.on_play_start = 0 AND k.result_match = 1) as otd_wins
+    FROM ({matches}) AS k
+    GROUP BY k.day, k.my_deck
+"""
+
+DAILY_ARCHETYPE_COUNTS = """
+    SELECT k.day, k.my_deck, k.opp_archetype, COUNT(*) as matches
+    FROM ({matches}) AS k
+    WHERE k.opp_archetype != ''
+    GROUP BY k.day, k.my_deck, k.opp_archetype
+"""
+
+def adjust_daily_counts(cur, match_filter, params, sign):
+    """Add (sign=1) or retract (sign=-1) the matches selected by match_filter in daily_rollup"""
+    cur.execute(f"""
+        INSERT INTO daily_rollup AS r (day, my_deck, {", ".join(DAILY_COUNTERS)})
+        SELECT c.day, c.my_deck, {", ".join(f"c.{name} * {sign}" for name in DAILY_COUNTERS)}
+        FROM ({DAILY_COUNTS.format(matches=f"{DAILY_MATCHES} AND {match_filter}")}) AS c
+        WHERE true  -- lets SQLite parse ON CONFLICT after a SELECT
+        ON CONFLICT (day, my_deck) DO UPDATE
+        SET {", ".join(f"{name} = r.{name} + EXCLUDED.{name}" for name in DAILY_COUNTERS)}
+    """, (APP_TIMEZONE, *params))
+    if sign < 0:
+        cur.execute("DELETE FROM daily_rollup WHERE matches <= 0")
+
+def adjust_daily_archetypes(cur, match_filter, params, sign):
+    """Same for daily_archetypes; on its own when only opp_archetype changes"""
+    cur.execute(f"""
+        INSERT INTO daily_archetypes AS r (day, my_deck, opp_archetype, matches)
+        SELECT c.day, c.my_deck, c.opp_archetype, c.matches * {sign}
+        FROM ({DAILY_ARCHETYPE_COUNTS.format(matches=f"{DAILY_MATCHES} AND {match_filter}")}) AS c
+        WHERE true
+        ON CONFLICT (day, my_deck, opp_archetype) DO UPDATE SET matches = r.matches + EXCLUDED.matches
+    """, (APP_TIMEZONE, *params))
+    if sign < 0:
+        cur.execute("DELETE FROM daily_archetypes WHERE matches <= 0")
+
+def adjust_daily_rollup(cur, match_filter, params, sign):
+    """Add (sign=1) or retract (sign=-1) the matches selected by match_filter; see adjust_card_rollup"""
+    adjust_daily_counts(cur, match_filter, params, sign)
+    adjust_daily_archetypes(cur, match_filter, params, sign)
+
+def rebuild_daily_rollup(cur):
+    """Recompute daily_rollup and daily_archetypes from scratch in APP_TIMEZONE"""
+    if not USE_SQLITE:
+        cur.execute("LOCK TABLE daily_rollup, daily_archetypes IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM daily_rollup")
+    cur.execute("DELETE FROM daily_archetypes")
+    cur.execute(f"""
+        INSERT INTO daily_rollup (day, my_deck, {", ".join(DAILY_COUNTERS)})
+        {DAILY_COUNTS.format(matches=DAILY_MATCHES)}
+    """, (APP_TIMEZONE,))
+    rows = cur.rowcount
+    cur.execute(f"""
+        INSERT INTO daily_archetypes (day, my_deck, opp_archetype, matches)
+        {DAILY_ARCHETYPE_COUNTS.format(matches=DAILY_MATCHES)}
+    """, (APP_TIMEZONE,))
+    cur.execute("""
+        INSERT INTO daily_rollup_zone (id, zone) VALUES (TRUE, %s)
+        ON CONFLICT (id) DO UPDATE SET zone = EXCLUDED.zone
+    """, (APP_TIMEZONE,))
+    return rows + cur.rowcount
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Opponents - Per-opponent latest deck and record, maintained on write
+# ─────────────────────────────────────────────────────────────────────────────
+
+# One row per opponent (recency = 1): their latest match, with totals over the selected matches
+OPPONENTS_SELECT = """
+    SELECT m.opp_name as name, lower(m.opp_name) as name_key,
+           m.opp_deck as last_deck, m.date_time as last_played,
+           COUNT(*) OVER per_opponent as matches,
+           COUNT(*) FILTER (WHERE m.result_match = 1) OVER per_opponent as wins,
+           COUNT(*) FILTER (WHERE m.result_match = 0) OVER per_opponent as losses,
+           ROW_NUMBER() OVER (per_opponent ORDER BY m.date_time DESC, m.id DESC) as recency
+    FROM matches m
+    WHERE m.opp_name != '' AND m.opp_name IS NOT NULL
+"""
+
+OPPONENTS_WINDOW = "WINDOW per_opponent AS (PARTITION BY m.opp_name)"
+
+OPPONENT_COUNTERS = ("matches", "wins", "losses")
+
+def adjust_opponents(cur, match_filter, params, sign):
+    """
+    Add (sign=1) or retract (sign=-1) the matches selected by match_filter;
+    retract before deleting them. Retracting re-reads the opponent's latest
+    remaining match through idx_opp_name_dt.
+    """
+    if sign > 0:
+        newer = "o.last_played IS NULL OR EXCLUDED.last_played >= o.last_played"
+        latest = f"""
+            last_deck = CASE WHEN {newer} THEN EXCLUDED.last_deck ELSE o.last_deck END,
+            last_played = CASE WHEN {newer} THEN EXCLUDED.last_played ELSE o.last_played END,
+        """
+    else:
+        latest = ""
+    cur.execute(f"""
+        INSERT INTO opponents AS o (name, name_key, last_deck, last_played, {", ".join(OPPONENT_COUNTERS)})
+        SELECT k.name, k.name_key, k.last_deck, k.last_played, {", ".join(f"k.{c} * {sign}" for c in OPPONENT_COUNTERS)}
+        FROM ({OPPONENTS_SELECT} AND {match_filter} {OPPONENTS_WINDOW}) AS k
+        WHERE k.recency = 1
+        ON CONFLICT (name) DO UPDATE
+        SET {latest} {", ".join(f"{c} = o.{c} + EXCLUDED.{c}" for c in OPPONENT_COUNTERS)}
+    """, params)
+    if sign < 0:
+        cur.execute("DELETE FROM opponents WHERE matches <= 0")
+        cur.execute(f"""
+            UPDATE opponents SET (last_deck, last_played) = (
+                SELECT m.opp_deck, m.date_time FROM matches m
+                WHERE m.opp_name = opponents.name AND NOT ({match_filter})
+                ORDER BY m.date_time DESC, m.id DESC
+                LIMIT 1
+            )
+            WHERE name IN (SELECT m.opp_name FROM matches m WHERE {match_filter})
+        """, (*params, *params))
+
+def rebuild_opponents(cur):
+    """Recompute opponents from scratch"""
+    if not USE_SQLITE:
+        cur.execute("LOCK TABLE opponents IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM opponents")
+    cur.execute(f"""
+        INSERT INTO opponents (name, name_key, last_deck, last_played, {", ".join(OPPONENT_COUNTERS)})
+        SELECT k.name, k.name_key, k.last_deck, k.last_played, {", ".join(f"k.{c}" for c in OPPONENT_COUNTERS)}
+        FROM ({OPPONENTS_SELECT} {OPPONENTS_WINDOW}) AS k
+        WHERE k.recency = 1
+    """)
+    return cur.rowcount
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Card Pairs - Opponent card co-occurrence as matrix products, cached per worker
+# ─────────────────────────────────────────────────────────────────────────────
+
+CARD_PAIRS_CHUNK = 5000  # matches counted per step of a rebuild
+
+def count_pairs(seen, size, decks):
+    """
+    Add the card pairs in one chunk of cards_seen rows (sorted by match) into
+    decks, a {my_deck: (together, wins)} dict of size x size matrices.
+    """
+    if not seen:
+        return
+    match_ids = np.fromiter((row["match_id"] for row in seen), dtype=np.int64, count=len(seen))
+    cols = np.fromiter((row["card_id"] for row in seen), dtype=np.int64, count=len(seen))
+    won = np.fromiter((row["result_match"] == 1 for row in seen), dtype=np.float64, count=len(seen))
+    deck_names, deck_of = np.unique([row["my_deck"] for row in seen], return_inverse=True)
+    # Nonzeros of A, numbered by match (row) so each match's cards are contiguous
+    _, rows = np.unique(match_ids, return_inverse=True)
+    
+    # A^T A without SciPy: every nonzero pairs with each nonzero in its row,
+    # and the pairs are counted into deck x card x card cells
+    per_row = np.bincount(rows)[rows]
+    left = np.repeat(np.arange(len(rows)), per_row)
+    block_start = np.repeat(np.cumsum(per_row) - per_row, per_row)
+    right = np.searchsorted(rows, rows[left]) + np.arange(len(left)) - block_start
+    cells = (deck_of[left] * size + cols[left]) * size + cols[right]
+    shape = (len(deck_names), size, size)
+    together = np.bincount(cells, minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+    wins = np.bincount(cells, weights=won[left], minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+    
+    for d, name in enumerate(deck_names):
+        if str(name) in decks:
+            deck_together, deck_wins = decks[str(name)]
+            deck_together += together[d]
+            deck_wins += wins[d]
+        else:
+            decks[str(name)] = (together[d].copy(), wins[d].copy())
+
+class CardPairMatrix:
+    """
+    Per-deck card x card counts of matches where both cards were seen
+    (together = A^T A for the match x card incidence matrix A) and of those
+    that were won (wins = A^T diag(won) A). Rebuilt from cards_seen when
+    pairs_version moves past it; this worker's own writes are applied as
+    rank-one updates instead (see note_card_pairs).
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.size = 0
+        self.decks = {}
+        self.rebuilds = 0
+    
+    def matrices(self, my_deck=None):
+        """Copies of (together, wins) for my_deck, or summed over every deck, at the current pairs_version"""
+        with db_cursor() as cur:
+            cur.execute("SELECT pairs_version FROM data_version")
+            version = cur.fetchone()["pairs_version"]
+        with self.lock:
+            if self.version is None or self.version < version:
+                self.rebuild()
+            if my_deck is not None:
+                empty = np.zeros((self.size, self.size), dtype=np.int32)
+                together, wins = self.decks.get(my_deck, (empty, empty))
+                return together.copy(), wins.copy()
+            together = np.zeros((self.size, self.size), dtype=np.int32)
+            wins = np.zeros((self.size, self.size), dtype=np.int32)
+            for deck_together, deck_wins in self.decks.values():
+                together += deck_together
+                wins += deck_wins
+            return together, wins
+    
+    def rebuild(self):
+        """Recount every match's cards, CARD_PAIRS_CHUNK matches at a time"""
+        decks = {}
+        with get_db() as conn:
+            cur = new_cursor(conn)
+            if not USE_SQLITE:
+                # Version and cards from one snapshot, so later writes are applied on top exactly once
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("SELECT pairs_version FROM data_version")
+            version = cur.fetchone()["pairs_version"]
+            cur.execute("SELECT COALESCE(MAX(id), 0) + 1 as size FROM cards")
+            size = cur.fetchone()["size"]
+            last_id = 0
+            while True:
+                cur.execute("""
+                    SELECT MAX(id) as chunk_end FROM (
+                        SELECT id FROM matches WHERE id > %s ORDER BY id LIMIT %s
+                    ) k
+                """, (last_id, CARD_PAIRS_CHUNK))
+                chunk_end = cur.fetchone()["chunk_end"]
+                if chunk_end is None:
+                    break
+                cur.execute("""
+                    SELECT cs.match_id, COALESCE(m.my_deck, '') as my_deck, m.result_match, cs.card_id
+                    FROM cards_seen cs JOIN matches m ON m.id = cs.match_id
+                    WHERE cs.match_id > %s AND cs.match_id <= %s
+                    ORDER BY cs.match_id
+                """, (last_id, chunk_end))
+                count_pairs(cur.fetchall(), size, decks)
+                last_id = chunk_end
+            cur.close()
+        
+        self.decks = decks
+        self.size = size
+        self.version = version
+        self.rebuilds += 1
+    
+    def advance(self, versions, changes):
+        """
+        Apply one request's committed writes (pairs_version values, and (my_deck, won,
+        card_ids, sign) changes) if they directly follow what the matrices
+        hold; otherwise leave them for the next rebuild.
+        """
+        with self.lock:
+            if self.version is None or versions != list(range(self.version + 1, self.version + 1 + len(versions))):
+                return
+            if any(card_id >= self.size for _, _, card_ids, _ in changes for card_id in card_ids):
+                self.version = None
+                return
+            for my_deck, won, card_ids, sign in changes:
+                if my_deck not in self.decks:
+                    self.decks[my_deck] = (
+                        np.zeros((self.size, self.size), dtype=np.int32),
+                        np.zeros((self.size, self.size), dtype=np.int32),
+                    )
+                together, wins = self.decks[my_deck]
+                cells = np.ix_(card_ids, card_ids)
+                together[cells] += sign
+                if won:
+                    wins[cells] += sign
+            self.version = versions[-1]
+
+card_pairs = CardPairMatrix()
+
+def bump_pairs_version(cur):
+    """
+    Mark matches' cards, deck or result as changed, so card_pairs rebuilds in
+    every worker that doesn't apply the change itself (see note_card_pairs)
+    """
+    cur.execute("UPDATE data_version SET pairs_version = pairs_version + 1 RETURNING pairs_version")
+    return cur.fetchone()["pairs_version"]
+
+def note_card_pairs(cur, match_filter, params, sign):
+    """
+    Queue the card sets of the matches selected by match_filter for
+    card_pairs, as adjust_card_rollup does for card_rollup: -1 before a
+    change, 1 after. They are applied once the request has committed.
+    """
+    version = bump_pairs_version(cur)
+    if not has_request_context():
+        return
+    cur.execute(f"""
+        SELECT COALESCE(m.my_deck, '') as my_deck, m.result_match, {sql_card_list("m.id")} as cards
+        FROM matches m WHERE {match_filter}
+    """, params)
+    g.setdefault("card_pair_versions", []).append(version)
+    g.setdefault("card_pair_changes", []).extend(
+        (row["my_deck"], row["result_match"] == 1, [card_id for card_id, _ in json_value(row["cards"]) or []], sign)
+        for row in cur.fetchall()
+    )
+
+@app.teardown_request
+def apply_card_pair_changes(exc):
+    if exc is None and "card_pair_versions" in g:
+        card_pairs.advance(g.card_pair_versions, g.card_pair_changes)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Data Version - Write counter shared by every worker, for cache validation
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bump_data_version(cur):
+    """Mark the data as changed; call from every write, inside its transaction"""
+    cur.execute("UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP RETURNING version")
+    return cur.fetchone()["version"]
+
+def get_data_version():
+    """(version, updated_at) of the last committed write, read once per request"""
+    if "data_version" not in g:
+        with db_cursor() as cur:
+            cur.execute("SELECT version, updated_at FROM data_version")
+            row = cur.fetchone()
+        g.data_version = (row["version"], as_datetime(row["updated_at"]))
+    return g.data_version
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Live Events - Match changes pushed to open pages over Server-Sent Events
+# ─────────────────────────────────────────────────────────────────────────────
+
+EVENTS_CHANNEL = "vibes_events"
+SSE_KEEPALIVE = _env_float("SSE_KEEPALIVE", 15.0)     # seconds between comments on an idle stream
+# Each open stream holds a request thread; leave the rest of the worker's threads for requests
+SSE_MAX_STREAMS = _env_int("SSE_MAX_STREAMS", max(GUNICORN_THREADS // 2, 1))
+SSE_MAX_AGE = _env_float("SSE_MAX_AGE", 300.0)        # seconds before a stream ends and the client reconnects
+SSE_RETRY_AFTER = 30                                  # seconds a client over SSE_MAX_STREAMS is told to wait
+SSE_QUEUE_SIZE = 100                                  # events buffered per stream before it is told to resync
+NOTIFY_MAX_BYTES = 7900                               # PostgreSQL caps NOTIFY payloads at 8000 bytes
+RESYNC_EVENT = json.dumps({"type": "resync"})
+
+def publish_event(cur, event):
+    """
+    Send event to every open /api/events stream once this transaction
+    commits: through NOTIFY on PostgreSQL, so all workers see it, and
+    in-process on SQLite. Events too large for NOTIFY become a resync.
+    """
+    payload = json.dumps(event)
+    if len(payload.encode()) > NOTIFY_MAX_BYTES:
+        payload = RESYNC_EVENT
+    if not USE_SQLITE:
+        cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+    elif has_request_context():
+        g.setdefault("events", []).append(payload)
+
+@app.teardown_request
+def broadcast_local_events(exc):
+    if exc is None and "events" in g:
+        for payload in g.events:
+            events.broadcast(payload)
+
+class EventHub:
+    """
+    This worker's SSE subscribers, one bounded queue each. On PostgreSQL a
+    daemon thread LISTENs on EVENTS_CHANNEL and fans notifications out.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.listener = None
+    
+    def subscribe(self):
+        """A new subscriber queue, or None when SSE_MAX_STREAMS are already open"""
+        subscription = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self.lock:
+            if len(self.subscribers) >= SSE_MAX_STREAMS:
+                return None
+            self.subscribers.add(subscription)
+            if not USE_SQLITE and self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name="event-listener", daemon=True)
+                self.listener.start()
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+    
+    def broadcast(self, payload):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(payload)
+            except queue.Full:
+                # A stalled client: drop its backlog and have it reload instead
+                while not subscription.empty():
+                    subscription.get_nowait()
+                subscription.put_nowait(RESYNC_EVENT)
+    
+    def listen(self):
+        connected_before = False
+        while True:
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    if connected_before:
+                        # Anything sent while we were disconnected is lost
+                        self.broadcast(RESYNC_EVENT)
+                    connected_before = True
+                    for notify in conn.notifies():
+                        self.broadcast(notify.payload)
+            except psycopg.Error as e:
+                app.logger.warning("Event listener disconnected: %s", e)
+                time.sleep(5)
+
+events = EventHub()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Archetype Reclassification - Re-score historical matches from cards_seen
+# ─────────────────────────────────────────────────────────────────────────────
+
+RECLASSIFY_CHUNK_SIZE = 5000
+
+def top_archetype(cards):
+    """(archetype, score, confidence) of the best detect_archetype match, or Nones"""
+    return get_archetype_matcher().best(cards) or (None, None, None)
+
+def classify_chunk(chunk):
+    """Score a list of (match_id, cards) pairs; runs inside reclassify worker processes"""
+    return [(match_id, *top_archetype(cards)) for match_id, cards in chunk]
+
+def reclassify_matches(chunk_size=RECLASSIFY_CHUNK_SIZE, workers=None):
+    """
+    Re-run detect_archetype over every match and store the result in the
+    detected_* columns. Matches are streamed through a server-side cursor in
+    chunks, scored across a process pool and written back with one COPY +
+    UPDATE. Returns the number of matches whose detection changed.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Compile once in the parent so forked workers inherit it
+    rebuild_archetype_matcher()
+    
+    with get_db() as conn:
+        write = new_cursor(conn)
+        if USE_SQLITE:
+            # Temp tables live as long as the (reused) connection, not the transaction
+            write.execute("DROP TABLE IF EXISTS temp.reclassified")
+        write.execute(f"""
+            CREATE TEMP TABLE reclassified(
+                id INTEGER PRIMARY KEY,
+                archetype TEXT,
+                score INTEGER,
+                confidence INTEGER
+            ) {"" if USE_SQLITE else "ON COMMIT DROP"}
+        """)
+        
+        def store(results):
+            bulk_insert(write, "reclassified", ("id", "archetype", "score", "confidence"), results)
+        
+        if USE_SQLITE:
+            read = new_cursor(conn)
+        else:
+            read = conn.cursor(name="reclassify_matches")
+            read.itersize = chunk_size
+        read.execute(f"SELECT m.id, {sql_card_list('m.id')} as cards FROM matches m ORDER BY m.id")
+        
+        if workers == 1:
+            while chunk := read.fetchmany(chunk_size):
+                store(classify_chunk([(r["id"], card_list(write, r["cards"])) for r in chunk]))
+        else:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                # Keep a bounded number of chunks in flight so memory stays flat
+                pending = []
+                while chunk := read.fetchmany(chunk_size):
+                    pending.append(executor.submit(classify_chunk, [(r["id"], card_list(write, r["cards"])) for r in chunk]))
+                    if len(pending) >= workers * 2:
+                        store(pending.pop(0).result())
+                for future in pending:
+                    store(future.result())
+        read.close()
+        
+        write.execute(f"""
+            UPDATE matches AS m
+            SET detected_archetype = r.archetype,
+                detected_score = r.score,
+                detected_confidence = r.confidence
+            FROM reclassified r
+            WHERE m.id = r.id
+              AND {sql_distinct("(m.detected_archetype, m.detected_score, m.detected_confidence)",
+                                "(r.archetype, r.score, r.confidence)")}
+        """)
+        changed = write.rowcount
+        if USE_SQLITE:
+            write.execute("DROP TABLE temp.reclassified")
+        if changed:
+            bump_data_version(write)
+        write.close()
+    return changed
+
+def now_iso():
+    return datetime.now().strftime("%Y-%m-%d %H:%M")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Instrumentation - Route latency, SQL counts and pool waits for /metrics
+# ─────────────────────────────────────────────────────────────────────────────
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") != "0"   # add a Server-Timing header to every response
+SLOW_QUERY_MS = _env_float("SLOW_QUERY_MS", 200.0)            # statements slower than this are logged
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+class RequestStats:
+    """SQL work done while serving one request"""
+    __slots__ = ("statements", "rows", "db_seconds", "pool_wait")
+    
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.pool_wait = 0.0
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+@lru_cache(maxsize=1024)
+def normalize_statement(query):
+    """Statement text with literals replaced and whitespace collapsed, for grouping"""
+    return _LITERALS.sub("?", " ".join(query.split()))[:300]
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """
+    Per-process counters in Prometheus text format. Each gunicorn worker
+    keeps its own, labelled with its pid.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.route_latency = defaultdict(Histogram)     # (route, method) -> Histogram
+        self.route_requests = Counter()                 # (route, method, status) -> n
+        self.route_statements = Counter()               # route -> SQL statements
+        self.route_rows = Counter()                     # route -> rows returned/affected
+        self.route_db_seconds = Counter()               # route -> seconds in SQL
+        self.statement_calls = Counter()                # normalized statement -> executions
+        self.statement_seconds = Counter()              # normalized statement -> total seconds
+        self.slow_statements = Counter()                # normalized statement -> n over SLOW_QUERY_MS
+        self.pool_wait = Histogram()
+    
+    def record_query(self, query, seconds, rows):
+        statement = normalize_statement(query)
+        stats = _request_stats.get()
+        with self.lock:
+            self.statement_calls[statement] += 1
+            self.statement_seconds[statement] += seconds
+            if stats is not None:
+                stats.statements += 1
+                stats.rows += rows
+                stats.db_seconds += seconds
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                self.slow_statements[statement] += 1
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            app.logger.warning("Slow query (%.0f ms): %s", seconds * 1000, statement)
+    
+    def record_rows(self, rows):
+        """Rows read after execute(), for drivers that only count them as they are fetched"""
+        stats = _request_stats.get()
+        if stats is not None:
+            with self.lock:
+                stats.rows += rows
+    
+    def record_pool_wait(self, seconds):
+        stats = _request_stats.get()
+        with self.lock:
+            self.pool_wait.observe(seconds)
+            if stats is not None:
+                stats.pool_wait += seconds
+    
+    def record_request(self, route, method, status, seconds, stats):
+        with self.lock:
+            self.route_latency[(route, method)].observe(seconds)
+            self.route_requests[(route, method, status)] += 1
+            self.route_statements[route] += stats.statements
+            self.route_rows[route] += stats.rows
+            self.route_db_seconds[route] += stats.db_seconds
+    
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        worker = f'worker="{os.getpid()}"'
+        
+        def labels(**values):
+            return ",".join([worker] + [f'{k}="{escape_label(v)}"' for k, v in values.items()])
+        
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for label_values, h in series:
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, h.buckets):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels(**label_values, le=bound)}}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels(**label_values, le="+Inf")}}} {h.count}')
+                lines.append(f"{name}_sum{{{labels(**label_values)}}} {h.sum}")
+                lines.append(f"{name}_count{{{labels(**label_values)}}} {h.count}")
+        
+        def counter(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for label_values, value in series:
+                lines.append(f"{name}{{{labels(**label_values)}}} {value}")
+        
+        with self.lock:
+            histogram("vibes_request_duration_seconds", "Request latency by route",
+                      [({"route": r, "method": m}, h) for (r, m), h in sorted(self.route_latency.items())])
+            counter("vibes_requests_total", "Requests by route and status",
+                    [({"route": r, "method": m, "status": s}, n) for (r, m, s), n in sorted(self.route_requests.items())])
+            counter("vibes_request_db_statements_total", "SQL statements executed by route",
+                    [({"route": r}, n) for r, n in sorted(self.route_statements.items())])
+            counter("vibes_request_db_rows_total", "Rows returned or affected by route",
+                    [({"route": r}, n) for r, n in sorted(self.route_rows.items())])
+            counter("vibes_request_db_seconds_total", "Seconds spent in SQL by route",
+                    [({"route": r}, n) for r, n in sorted(self.route_db_seconds.items())])
+            counter("vibes_db_statement_calls_total", "Executions by normalized statement",
+                    [({"statement": st}, n) for st, n in sorted(self.statement_calls.items())])
+            counter("vibes_db_statement_seconds_total", "Seconds spent by normalized statement",
+                    [({"statement": st}, n) for st, n in sorted(self.statement_seconds.items())])
+            counter("vibes_db_slow_statements_total", f"Statements slower than {SLOW_QUERY_MS:g} ms",
+                    [({"statement": st}, n) for st, n in sorted(self.slow_statements.items())])
+            histogram("vibes_db_pool_wait_seconds", "Time to get a pooled connection", [({}, self.pool_wait)])
+        
+        if _pool is not None:
+            pool_stats = _pool.get_stats()
+            lines.append("# HELP vibes_db_pool_connections Connection pool state")
+            lines.append("# TYPE vibes_db_pool_connections gauge")
+            for key in ("pool_size", "pool_available", "requests_waiting"):
+                lines.append(f'vibes_db_pool_connections{{{labels(state=key)}}} {pool_stats.get(key, 0)}')
+        
+        cache = result_cache.stats()
+        counter("vibes_result_cache_lookups_total", "Analytics result cache lookups",
+                [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])])
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class InstrumentedCursor(psycopg.Cursor):
+    """Cursor that reports every execute() to metrics (installed on pooled connections)"""
+    
+    def execute(self, query, params=None, **kwargs):
+        # The pool's health check runs an empty statement; that time already counts as pool wait
+        if not query:
+            return super().execute(query, params, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            metrics.record_query(str(query), time.perf_counter() - start, max(self.rowcount, 0))
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.request_stats = RequestStats()
+        _request_stats.set(g.request_stats)
+    
+    @app.after_request
+    def record_request_metrics(response):
+        # Registered ahead of compress_response, so this runs after it and includes it
+        elapsed = time.perf_counter() - g.request_started
+        stats = g.request_stats
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.record_request(route, request.method, response.status_code, elapsed, stats)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = (
+                f'app;dur={elapsed * 1000:.1f}, '
+                f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} queries, {stats.rows} rows", '
+                f'pool;dur={stats.pool_wait * 1000:.1f}'
+            )
+        return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def in_current_context(fn):
+    """Wrap fn to run in a copy of the caller's context, so worker threads report to the same request"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# HTTP Caching - ETag / Last-Modified revalidation
+# ─────────────────────────────────────────────────────────────────────────────
+
+def content_etag(value):
+    """Stable tag for JSON-serializable in-code data (CARD_LIST, ARCHETYPES)"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+def static_version():
+    return content_etag([CARD_LIST, ARCHETYPES]), None
+
+def db_version():
+    version, updated_at = get_data_version()
+    # The timestamp keeps tags unique if the database is ever recreated
+    return f"v{version}.{int(updated_at.timestamp())}", updated_at
+
+def conditional(validator):
+    """
+    Tag the view's response with the ETag / Last-Modified returned by
+    validator() and answer 304 without running the view when the client's
+    copy is still current. Clients must revalidate (no-cache), which costs
+    one cheap version lookup instead of the full query.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validator()
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
             else:
-                estimated_copies = 1
-            
-            # Only include cards that appear in at least 20% of matches
-            if appearance_rate >= 20:
-                estimated_deck.append({
-                    "card": card_name,
-                    "estimated_copies": estimated_copies,
-                    "appearance_rate": appearance_rate,
-                    "times_seen": times_seen,
-                    "matches_appeared": matches_appeared
-                })
-                total_cards += estimated_copies
+                response = app.response_class(status=304)
+            # Weak, since the body may be compressed per client
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Result Cache - Per-worker LRU for analytics, invalidated by data_version
+# ─────────────────────────────────────────────────────────────────────────────
+
+RESULT_CACHE_SIZE = _env_int("RESULT_CACHE_SIZE", 256)        # responses kept per worker
+RESULT_CACHE_TTL = _env_float("RESULT_CACHE_TTL", 300.0)      # seconds before an entry is recomputed
+
+class ResultCache:
+    """
+    Bounded LRU of response bodies with a TTL. Keys include the data version,
+    so a write anywhere (in any worker) makes every older entry unreachable;
+    those simply age out of the LRU.
+    """
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+            }
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+def cached_result(view):
+    """Serve repeated reads of view from result_cache; only 200 responses are stored"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if RESULT_CACHE_SIZE <= 0:
+            return view(*args, **kwargs)
+        version, _ = get_data_version()
+        key = (
+            request.endpoint,
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            version,
+        )
+        cached = result_cache.get(key)
+        if cached is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cached = (response.get_data(), response.mimetype)
+            result_cache.set(key, cached)
+        body, mimetype = cached
+        return app.response_class(body, mimetype=mimetype)
+    return wrapper
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Response Compression
+# ─────────────────────────────────────────────────────────────────────────────
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/csv", "application/x-ndjson"}
+
+@app.after_request
+def compress_response(response):
+    """Brotli/gzip-encode larger text responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESS_MIMETYPES or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        # Low quality levels are fast enough for per-request compression
+        response.set_data(brotli.compress(body, quality=4))
+        response.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Pages
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.route("/")
+def index():
+    return render_template("index.html", parquet_export=pq is not None)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Card List & Archetype Detection
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.route("/api/cards")
+@conditional(static_version)
+def get_cards():
+    """Return all card names for autocomplete"""
+    return jsonify(CARD_INDEX.cards)
+
+CARD_SEARCH_MAX = 50
+
+@app.route("/api/cards/search")
+@conditional(static_version)
+def search_cards():
+    """Ranked card names for a partial or misspelled query (?q=...&limit=10)"""
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), CARD_SEARCH_MAX)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify(CARD_INDEX.search(request.args.get("q", ""), limit))
+
+@app.route("/api/archetypes")
+@conditional(static_version)
+def get_archetypes():
+    """Return all archetype names"""
+    return jsonify(sorted(ARCHETYPES.keys()))
+
+@app.route("/api/detect-archetype", methods=["POST"])
+def detect_archetype_api():
+    """Detect archetype from list of cards seen"""
+    cards = request.json.get("cards", [])
+    results = detect_archetype(cards)
+    return jsonify(results)
+
+DETECT_BATCH_MAX = 1000
+
+@app.route("/api/detect-archetype/batch", methods=["POST"])
+def detect_archetype_batch_api():
+    """Detect archetypes for many card lists at once; results are in request order"""
+    card_lists = request.json.get("card_lists", [])
+    if len(card_lists) > DETECT_BATCH_MAX:
+        return jsonify({"error": f"At most {DETECT_BATCH_MAX} card lists per request"}), 400
+    return jsonify([detect_archetype(cards) for cards in card_lists])
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Matches API
+# ─────────────────────────────────────────────────────────────────────────────
+
+MATCHES_PAGE_SIZE = 50
+MATCHES_MAX_PAGE_SIZE = 500
+
+def encode_cursor(date_time, match_id):
+    """Opaque keyset cursor for the (date_time, id) position of a match"""
+    raw = json.dumps([iso_timestamp(date_time), match_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_time, match_id = json.loads(raw)
+        date_time = datetime.fromisoformat(date_time)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if date_time.tzinfo is None or not isinstance(match_id, int):
+        raise ValueError("Invalid cursor")
+    return date_time, match_id
+
+MATCH_SELECT = f"""
+    SELECT m.id, m.date_time, m.my_deck, m.opp_name, m.opp_deck,
+           m.result_match, m.on_play_start, m.notes, m.detected_archetype,
+           {sql_card_list("m.id")} as cards_seen
+    FROM matches m
+"""
+
+def match_json(cur, row):
+    """A MATCH_SELECT row as the API returns it (cur looks up card names)"""
+    return {**row, "date_time": iso_timestamp(row["date_time"]), "cards_seen": card_list(cur, row["cards_seen"])}
+
+@app.route("/api/matches", methods=["GET"])
+def get_matches():
+    """
+    Page through matches newest first. Pass `limit` (default 50, max 500) and
+    the `next_cursor` of the previous page as `after` to continue. Dates are
+    days in ?tz= (see request_date_range).
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", MATCHES_PAGE_SIZE)), 1), MATCHES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    query = MATCH_SELECT + " WHERE 1=1"
+    date_clauses, params = date_range_sql("m.date_time", start, end)
+    for clause in date_clauses:
+        query += " AND " + clause
+    
+    if request.args.get("my_deck"):
+        query += " AND m.my_deck LIKE %s"
+        params.append("%" + request.args.get("my_deck") + "%")
+    if request.args.get("opp_deck"):
+        query += " AND m.opp_deck LIKE %s"
+        params.append("%" + request.args.get("opp_deck") + "%")
+    if request.args.get("result") == "win":
+        query += " AND m.result_match = 1"
+    elif request.args.get("result") == "loss":
+        query += " AND m.result_match = 0"
+    if request.args.get("after"):
+        try:
+            after_dt, after_id = decode_cursor(request.args.get("after"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # Keyset: continue strictly after the last row of the previous page
+        query += " AND (m.date_time, m.id) < (%s, %s)"
+        params.extend([after_dt, after_id])
+    
+    # Fetch one extra row to know whether another page exists
+    query += " ORDER BY m.date_time DESC, m.id DESC LIMIT %s"
+    params.append(limit + 1)
+    
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        matches = [match_json(cur, row) for row in cur.fetchall()]
+    
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        last = matches[-1]
+        next_cursor = encode_cursor(last["date_time"], last["id"])
+    
+    return jsonify({"matches": matches, "next_cursor": next_cursor})
+
+@app.route("/api/matches", methods=["POST"])
+def add_match():
+    data = request.json
+    cards_seen = canonical_cards(data.get("cards_seen", []))
+    with db_cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO matches (date_time, my_deck, opp_name, opp_deck, opp_archetype,
+                                 result_match, on_play_start, notes,
+                                 detected_archetype, detected_score, detected_confidence)
+            VALUES (%s, %s, %s, %s, {canonical_archetype_sql("%s")}, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            utc_now(),
+            data.get("my_deck", ""),
+            data.get("opp_name", ""),
+            data.get("opp_deck", ""),
+            data.get("opp_deck", ""),
+            data.get("opp_deck", ""),
+            1 if data.get("result") == "win" else 0,
+            data.get("on_play"),
+            data.get("notes", ""),
+            *top_archetype(cards_seen)
+        ))
         
-        # Trim or note if over 52
-        deck_status = "complete" if 48 <= total_cards <= 56 else "partial" if total_cards < 48 else "overflow"
-        
-        result.append({
-            "archetype": archetype_name,
-            "match_count": match_count,
-            "estimated_deck": estimated_deck[:30],  # Cap at 30 unique cards
-            "total_estimated_cards": total_cards,
-            "deck_status": deck_status,
-            "confidence": min(100, round(match_count * 5))  # More matches = higher confidence, cap at 100
-        })
+        match_id = cur.fetchone()["id"]
+        
+        if cards_seen:
+            insert_cards(cur, match_id, cards_seen)
+        
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), 1)
+        adjust_daily_rollup(cur, "m.id = %s", (match_id,), 1)
+        adjust_opponents(cur, "m.id = %s", (match_id,), 1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), 1)
+        bump_data_version(cur)
+        
+        cur.execute(MATCH_SELECT + " WHERE m.id = %s", (match_id,))
+        publish_event(cur, {"type": "match_added", "match": match_json(cur, cur.fetchone())})
     
-    # Sort by match count
-    result.sort(key=lambda x: x["match_count"], reverse=True)
+    return jsonify({"success": True, "id": match_id})
+
+def insert_cards(cur, match_id, cards):
+    """Add one sighting per entry in cards; new cards go after the ones already seen"""
+    ids = card_ids(cur, cards)
+    cur.executemany("""
+        INSERT INTO cards_seen AS s (match_id, card_id, quantity, position)
+        VALUES (%s, %s, %s, (SELECT COALESCE(MAX(position), 0) + 1 FROM cards_seen WHERE match_id = %s))
+        ON CONFLICT (match_id, card_id) DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity
+    """, [(match_id, ids[name], quantity, match_id) for name, quantity in Counter(cards).items()])
+
+def remove_cards(cur, match_id, cards):
+    """Remove one sighting per entry in cards (so duplicates remove several copies)"""
+    cur.executemany("""
+        UPDATE cards_seen SET quantity = quantity - %s
+        WHERE match_id = %s AND card_id = (SELECT id FROM cards WHERE name = %s)
+    """, [(copies, match_id, name) for name, copies in Counter(cards).items()])
+    cur.execute("DELETE FROM cards_seen WHERE match_id = %s AND quantity <= 0", (match_id,))
+
+@app.route("/api/matches/<int:match_id>", methods=["DELETE"])
+def delete_match(match_id):
+    with db_cursor() as cur:
+        if lock_match(cur, match_id):
+            adjust_card_rollup(cur, "m.id = %s", (match_id,), -1)
+            adjust_daily_rollup(cur, "m.id = %s", (match_id,), -1)
+            adjust_opponents(cur, "m.id = %s", (match_id,), -1)
+            note_card_pairs(cur, "m.id = %s", (match_id,), -1)
+        cur.execute("DELETE FROM cards_seen WHERE match_id = %s", (match_id,))
+        cur.execute("DELETE FROM matches WHERE id = %s RETURNING date_time, result_match", (match_id,))
+        deleted = cur.fetchone()
+        bump_data_version(cur)
+        if deleted:
+            publish_event(cur, {
+                "type": "match_deleted",
+                "id": match_id,
+                "date_time": iso_timestamp(deleted["date_time"]),
+                "result_match": deleted["result_match"]
+            })
+    return jsonify({"success": True})
+
+@app.route("/api/matches/<int:match_id>/cards", methods=["POST"])
+def add_card_to_match(match_id):
+    """Add a card to an existing match"""
+    card_name = canonical_cards([request.json.get("card_name")])[0]
+    with db_cursor() as cur:
+        if not lock_match(cur, match_id):
+            return jsonify({"error": "Match not found"}), 404
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), -1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), -1)
+        insert_cards(cur, match_id, [card_name])
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), 1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), 1)
+        redetect_archetype(cur, match_id)
+        bump_data_version(cur)
+        publish_cards_changed(cur, match_id)
+    return jsonify({"success": True})
+
+@app.route("/api/matches/<int:match_id>/cards/<card_name>", methods=["DELETE"])
+def remove_card_from_match(match_id, card_name):
+    """Remove a card from a match"""
+    card_name = canonical_cards([card_name])[0]
+    with db_cursor() as cur:
+        if not lock_match(cur, match_id):
+            return jsonify({"error": "Match not found"}), 404
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), -1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), -1)
+        remove_cards(cur, match_id, [card_name])
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), 1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), 1)
+        redetect_archetype(cur, match_id)
+        bump_data_version(cur)
+        publish_cards_changed(cur, match_id)
+    return jsonify({"success": True})
+
+def redetect_archetype(cur, match_id):
+    """Re-score a match's cards and store the top archetype; returns its cards"""
+    cur.execute(f"SELECT {sql_card_list('%s')} as cards", (match_id,))
+    cards = card_list(cur, cur.fetchone()["cards"])
+    cur.execute("""
+        UPDATE matches SET detected_archetype = %s, detected_score = %s, detected_confidence = %s
+        WHERE id = %s
+    """, (*top_archetype(cards), match_id))
+    return cards
+
+def publish_cards_changed(cur, match_id):
+    cur.execute(f"SELECT m.detected_archetype, {sql_card_list('m.id')} as cards FROM matches m WHERE m.id = %s", (match_id,))
+    row = cur.fetchone()
+    publish_event(cur, {
+        "type": "cards_changed",
+        "id": match_id,
+        "cards_seen": card_list(cur, row["cards"]),
+        "detected_archetype": row["detected_archetype"]
+    })
+
+IDEMPOTENCY_KEY_TTL = "1 day"
+
+@app.route("/api/matches/<int:match_id>/cards/delta", methods=["POST"])
+def apply_card_delta(match_id):
+    """
+    Apply {"add": [...], "remove": [...]} to a match's cards atomically.
+    Send an Idempotency-Key header (or "idempotency_key") so a retried
+    request replays the first response instead of applying twice; reusing
+    a key for another match or body is rejected with 422.
+    """
+    data = request.json
+    adds = canonical_cards(data.get("add", []))
+    removes = canonical_cards(data.get("remove", []))
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    request_hash = hashlib.sha256(json.dumps(
+        {"match_id": match_id, "add": adds, "remove": removes}, sort_keys=True
+    ).encode()).hexdigest()
+    
+    with db_cursor() as cur:
+        # The row lock also makes a concurrent retry wait for the first attempt
+        if not lock_match(cur, match_id):
+            return jsonify({"error": "Match not found"}), 404
+        
+        if key:
+            cur.execute("""
+                INSERT INTO idempotency_keys (key, match_id, request_hash) VALUES (%s, %s, %s)
+                ON CONFLICT (key) DO NOTHING
+            """, (key, match_id, request_hash))
+            if cur.rowcount == 0:
+                cur.execute("SELECT request_hash, response FROM idempotency_keys WHERE key = %s", (key,))
+                stored = cur.fetchone()
+                # Only replay the exact request the key was first used for
+                if stored["request_hash"] != request_hash:
+                    return jsonify({"error": "Idempotency key was already used for a different request"}), 422
+                return jsonify(json_value(stored["response"]))
+        
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), -1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), -1)
+        if removes:
+            remove_cards(cur, match_id, removes)
+        if adds:
+            insert_cards(cur, match_id, adds)
+        adjust_card_rollup(cur, "m.id = %s", (match_id,), 1)
+        note_card_pairs(cur, "m.id = %s", (match_id,), 1)
+        
+        cards = redetect_archetype(cur, match_id)
+        bump_data_version(cur)
+        publish_cards_changed(cur, match_id)
+        
+        response = {"success": True, "cards_seen": cards}
+        if key:
+            cur.execute(
+                "UPDATE idempotency_keys SET response = %s WHERE key = %s",
+                (json_param(response), key)
+            )
+            cur.execute(f"DELETE FROM idempotency_keys WHERE {sql_older_than('created_at', IDEMPOTENCY_KEY_TTL)}")
+    
+    return jsonify(response)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Stats & Analytics
+# ─────────────────────────────────────────────────────────────────────────────
+
+def win_rate(wins, total):
+    return round(wins / total * 100, 1) if total > 0 else 0
+
+def summarize_record(row):
+    """Win/loss and play/draw split for one row of the stats aggregate"""
+    return {
+        "total": row["total"],
+        "wins": row["wins"],
+        "losses": row["total"] - row["wins"],
+        "win_rate": win_rate(row["wins"], row["total"]),
+        "otp_total": row["otp_total"],
+        "otp_wins": row["otp_wins"],
+        "otp_win_rate": win_rate(row["otp_wins"], row["otp_total"]),
+        "otd_total": row["otd_total"],
+        "otd_wins": row["otd_wins"],
+        "otd_win_rate": win_rate(row["otd_wins"], row["otd_total"])
+    }
+
+@app.route("/api/stats")
+@conditional(db_version)
+@cached_result
+def get_stats():
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(query_stats(request.args.get("my_deck"), start, end))
+
+def query_stats(my_deck=None, start=None, end=None):
+    """Overall record plus per-matchup and per-deck breakdowns, for date_time in [start, end)"""
+    where_clauses, params = date_range_sql("date_time", start, end)
     
-    cur.close()
-    conn.close()
+    if my_deck:
+        where_clauses.append("my_deck = %s")
+        params.append(my_deck)
     
-    return jsonify(result)
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    
+    counters = """
+        COUNT(*) as total,
+        COUNT(*) FILTER (WHERE result_match = 1) as wins,
+        COUNT(*) FILTER (WHERE on_play_start = 1) as otp_total,
+        COUNT(*) FILTER (WHERE on_play_start = 1 AND result_match = 1) as otp_wins,
+        COUNT(*) FILTER (WHERE on_play_start = 0) as otd_total,
+        COUNT(*) FILTER (WHERE on_play_start = 0 AND result_match = 1) as otd_wins
+    """
+    if USE_SQLITE:
+        # No GROUPING SETS in SQLite: the same three groupings, unioned
+        query = f"""
+            SELECT 1 as no_opp, 1 as no_my, NULL as opp_deck, NULL as my_deck, {counters}
+            FROM matches WHERE {where_sql}
+            UNION ALL
+            SELECT 0, 1, opp_deck, NULL, {counters} FROM matches WHERE {where_sql} GROUP BY opp_deck
+            UNION ALL
+            SELECT 1, 0, NULL, my_deck, {counters} FROM matches WHERE {where_sql} GROUP BY my_deck
+            ORDER BY total DESC
+        """
+        params = params * 3
+    else:
+        # One scan: overall totals, per-matchup and per-deck rows via grouping sets,
+        # with every counter as a conditional aggregate
+        query = f"""
+            SELECT GROUPING(opp_deck) as no_opp, GROUPING(my_deck) as no_my,
+                   opp_deck, my_deck, {counters}
+            FROM matches
+            WHERE {where_sql}
+            GROUP BY GROUPING SETS ((), (opp_deck), (my_deck))
+            ORDER BY total DESC
+        """
+    
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    
+    overall = {"total": 0, "wins": 0, "otp_total": 0, "otp_wins": 0, "otd_total": 0, "otd_wins": 0}
+    matchups = []
+    my_decks = []
+    for row in rows:
+        if row["no_opp"] and row["no_my"]:
+            overall = row
+        elif not row["no_opp"]:
+            if row["opp_deck"]:
+                matchups.append({"opp_deck": row["opp_deck"], **summarize_record(row)})
+        elif row["my_deck"]:
+            my_decks.append({"my_deck": row["my_deck"], **summarize_record(row)})
+    
+    return {
+        **summarize_record(overall),
+        "matchups": matchups,
+        "my_decks": my_decks
+    }
 
-@app.route("/api/meta/archetype/<archetype>")
-def get_archetype_detail(archetype):
-    """Get detailed card breakdown for a specific archetype (normalized)"""
-    conn = get_db()
-    cur = conn.cursor()
+@app.route("/api/analytics/cards-in-losses")
+@conditional(db_version)
+@cached_result
+def cards_in_losses():
+    """Cards most commonly seen in losses"""
+    return jsonify(query_card_counts(0, request.args.get("my_deck")))
+
+@app.route("/api/analytics/cards-in-wins")
+@conditional(db_version)
+@cached_result
+def cards_in_wins():
+    """Cards most commonly seen in wins"""
+    return jsonify(query_card_counts(1, request.args.get("my_deck")))
+
+def query_card_counts(result_match, my_deck=None):
+    """Top 20 cards by sightings in matches with the given result"""
+    query = """
+        SELECT c.name as card_name, SUM(r.times_seen) as count
+        FROM card_rollup r
+        JOIN cards c ON c.id = r.card_id
+        WHERE r.result_match = %s
+    """
+    params = [result_match]
     
-    # Get all matches that normalize to this archetype
-    cur.execute("SELECT id, opp_deck FROM matches WHERE opp_deck != '' AND opp_deck IS NOT NULL")
-    all_matches = cur.fetchall()
+    if my_deck:
+        query += " AND r.my_deck = %s"
+        params.append(my_deck)
     
-    match_ids = [m["id"] for m in all_matches if normalize_archetype(m["opp_deck"]) == archetype]
-    match_count = len(match_ids)
+    query += " GROUP BY c.id ORDER BY count DESC LIMIT 20"
     
-    if match_count == 0:
-        cur.close()
-        conn.close()
-        return jsonify({"error": "Archetype not found"}), 404
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
     
-    # Get all cards with full stats
-    placeholders = ','.join(['%s'] * len(match_ids))
-    cur.execute(f"""
-        SELECT cs.card_name, 
-               COUNT(*) as times_seen,
-               COUNT(DISTINCT m.id) as matches_appeared,
-               SUM(CASE WHEN m.result_match = 1 THEN 1 ELSE 0 END) as times_in_wins,
-               SUM(CASE WHEN m.result_match = 0 THEN 1 ELSE 0 END) as times_in_losses
-        FROM cards_seen cs
-        JOIN matches m ON cs.match_id = m.id
-        WHERE m.id IN ({placeholders})
-        GROUP BY cs.card_name
-        ORDER BY matches_appeared DESC, times_seen DESC
-    """, match_ids)
-    
-    cards = []
-    for row in cur.fetchall():
-        appearance_rate = round(row["matches_appeared"] / match_count * 100, 1)
-        avg_copies = row["times_seen"] / row["matches_appeared"] if row["matches_appeared"] > 0 else 0
-        
-        cards.append({
+    return [{"card": r["card_name"], "count": r["count"]} for r in rows]
+
+@app.route("/api/analytics/winrate-vs-card")
+@conditional(db_version)
+@cached_result
+def winrate_vs_card():
+    """Win rate when opponent plays specific cards"""
+    return jsonify(query_winrate_vs_card(request.args.get("my_deck")))
+
+def query_winrate_vs_card(my_deck=None):
+    """Record against each card seen at least 3 times"""
+    query = """
+        SELECT c.name as card_name,
+               SUM(r.times_seen) as total,
+               COALESCE(SUM(r.times_seen) FILTER (WHERE r.result_match = 1), 0) as wins
+        FROM card_rollup r
+        JOIN cards c ON c.id = r.card_id
+    """
+    params = []
+    
+    if my_deck:
+        query += " WHERE r.my_deck = %s"
+        params.append(my_deck)
+    
+    query += " GROUP BY c.id HAVING SUM(r.times_seen) >= 3 ORDER BY SUM(r.times_seen) DESC"
+    
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    
+    results = []
+    for r in rows:
+        results.append({
+            "card": r["card_name"],
+            "total": r["total"],
+            "wins": r["wins"],
+            "losses": r["total"] - r["wins"],
+            "win_rate": round(r["wins"] / r["total"] * 100, 1)
+        })
+    
+    return results
+
+CARD_PAIRS_LIMIT = 20
+CARD_PAIRS_MAX_LIMIT = 500
+CARD_PAIRS_SORTS = ("matches", "win_rate")
+
+@app.route("/api/analytics/card-pairs")
+@conditional(db_version)
+@cached_result
+def card_pairs_api():
+    """
+    Opponent cards seen in the same match, with your record when both showed
+    up. Filter by my_deck, ?card= (pairs including that card) and
+    ?min_matches= (default 3); ?sort=win_rate puts the worst pairs first;
+    ?limit= keeps the top k (default 20).
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", CARD_PAIRS_LIMIT)), 1), CARD_PAIRS_MAX_LIMIT)
+        min_matches = max(int(request.args.get("min_matches", 3)), 1)
+    except ValueError:
+        return jsonify({"error": "limit and min_matches must be integers"}), 400
+    sort = request.args.get("sort", "matches")
+    if sort not in CARD_PAIRS_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(CARD_PAIRS_SORTS)}"}), 400
+    
+    card_id = None
+    if request.args.get("card"):
+        card_name = CARD_INDEX.canonicalize(request.args.get("card"))
+        with db_cursor() as cur:
+            cur.execute("SELECT id FROM cards WHERE name = %s", (card_name,))
+            row = cur.fetchone()
+        if row is None:
+            return jsonify({"error": "Card not found"}), 404
+        card_id = row["id"]
+    
+    return jsonify(query_card_pairs(request.args.get("my_deck"), card_id, limit, min_matches, sort))
+
+def query_card_pairs(my_deck=None, card_id=None, limit=CARD_PAIRS_LIMIT, min_matches=3, sort="matches"):
+    """Top card pairs by matches seen together (or lowest win rate) from card_pairs"""
+    together, wins = card_pairs.matrices(my_deck or None)
+    if card_id is not None:
+        if card_id >= len(together):
+            return []
+        mask = np.zeros(together.shape, dtype=bool)
+        mask[card_id] = together[card_id] >= min_matches
+        mask[card_id, card_id] = False
+    else:
+        # Each unordered pair once, above the diagonal (the diagonal is single-card counts)
+        mask = np.triu(together >= min_matches, k=1)
+    first, second = np.nonzero(mask)
+    counts = together[first, second]
+    won = wins[first, second]
+    
+    if sort == "win_rate":
+        order = np.lexsort((second, first, -counts, won / counts))
+    else:
+        order = np.lexsort((second, first, won / counts, -counts))
+    order = order[:limit]
+    
+    with db_cursor() as cur:
+        names = card_names(cur, np.concatenate([first[order], second[order]]).tolist())
+    return [
+        {
+            "cards": [names[int(first[i])], names[int(second[i])]],
+            "matches": int(counts[i]),
+            "wins": int(won[i]),
+            "losses": int(counts[i] - won[i]),
+            "win_rate": win_rate(int(won[i]), int(counts[i]))
+        }
+        for i in order
+    ]
+
+# Each section runs on its own pooled connection, so they overlap in the database
+DASHBOARD_SECTIONS = {
+    "stats": lambda f: query_stats(f["my_deck"], f["start"], f["end"]),
+    "cards_in_losses": lambda f: query_card_counts(0, f["my_deck"]),
+    "cards_in_wins": lambda f: query_card_counts(1, f["my_deck"]),
+    "winrate_vs_card": lambda f: query_winrate_vs_card(f["my_deck"]),
+}
+
+_dashboard_executor = ThreadPoolExecutor(max_workers=len(DASHBOARD_SECTIONS), thread_name_prefix="dashboard")
+
+@app.route("/api/dashboard")
+@conditional(db_version)
+@cached_result
+def get_dashboard():
+    """
+    Stats and card analytics in one response, with the sub-queries run
+    concurrently. Takes the /api/stats filters (the card sections only use
+    my_deck) and an optional comma-separated ?sections= subset.
+    """
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filters = {"my_deck": request.args.get("my_deck"), "start": start, "end": end}
+    sections = request.args.get("sections")
+    names = [n.strip() for n in sections.split(",") if n.strip()] if sections else list(DASHBOARD_SECTIONS)
+    unknown = [n for n in names if n not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown sections: {', '.join(unknown)}"}), 400
+    
+    futures = {
+        name: _dashboard_executor.submit(in_current_context(DASHBOARD_SECTIONS[name]), filters)
+        for name in names
+    }
+    return jsonify({name: future.result() for name, future in futures.items()})
+
+TRENDS_PERIODS = {"day": 1, "week": 7}
+TRENDS_WINDOW = 20
+TRENDS_MAX_WINDOW = 500
+
+@app.route("/api/trends")
+@conditional(db_version)
+@cached_result
+def get_trends():
+    """
+    Record, play/draw split and opponent archetype share per ?period= (day or
+    week), plus the win rate over the last ?window= matches (default 20) as of
+    the end of each period. Takes the /api/stats filters. Days are those of
+    the daily tables, cut in APP_TIMEZONE whatever ?tz= says; "tz" in the
+    response names that zone.
+    """
+    period = request.args.get("period", "day")
+    if period not in TRENDS_PERIODS:
+        return jsonify({"error": "period must be day or week"}), 400
+    try:
+        window = min(max(int(request.args.get("window", TRENDS_WINDOW)), 1), TRENDS_MAX_WINDOW)
+    except ValueError:
+        return jsonify({"error": "window must be an integer"}), 400
+    try:
+        request_zone()  # still rejects an unknown ?tz=
+        # Another zone's days would cut across the stored ones, so dates are APP_TIMEZONE days
+        zone = zone_named(APP_TIMEZONE)
+        start, end = request_date_range(zone)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(query_trends(request.args.get("my_deck"), start, end, zone, period, window))
+
+def query_trends(my_deck, start, end, zone, period="day", window=TRENDS_WINDOW):
+    """Per-period records for date_time in [start, end), summed from the daily tables (days cut in zone)"""
+    where_clauses, params = [], []
+    if start:
+        where_clauses.append("day >= %s")
+        params.append(start.date())
+    if end:
+        where_clauses.append("day < %s")
+        params.append(end.date())
+    if my_deck:
+        where_clauses.append("my_deck = %s")
+        params.append(my_deck)
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    with db_cursor() as cur:
+        cur.execute(f"""
+            SELECT day, {", ".join(f"SUM({name}) as {name}" for name in DAILY_COUNTERS)}
+            FROM daily_rollup WHERE {where_sql}
+            GROUP BY day
+        """, params)
+        count_rows = cur.fetchall()
+        cur.execute(f"""
+            SELECT day, opp_archetype, SUM(matches) as matches
+            FROM daily_archetypes WHERE {where_sql}
+            GROUP BY day, opp_archetype
+        """, params)
+        archetype_rows = cur.fetchall()
+    
+    # Fold days into periods (weeks start on Monday)
+    periods = defaultdict(lambda: {"counts": Counter(), "archetypes": Counter()})
+    def period_of(value):
+        day = as_date(value)
+        return periods[day - timedelta(days=day.weekday()) if period == "week" else day]
+    for row in count_rows:
+        period_of(row["day"])["counts"].update({
+            "total": row["matches"], **{name: row[name] for name in DAILY_COUNTERS if name != "matches"}
+        })
+    for row in archetype_rows:
+        if row["opp_archetype"]:
+            period_of(row["day"])["archetypes"][row["opp_archetype"]] += row["matches"]
+    
+    starts = sorted(periods)
+    ends = []
+    for d in starts:
+        # Local midnight after the period (wall-clock arithmetic, as in request_date_range)
+        period_end = datetime(d.year, d.month, d.day, tzinfo=zone) + timedelta(days=TRENDS_PERIODS[period])
+        ends.append(min(period_end, end) if end else period_end)
+    rolling = query_rolling_win_rates(ends, my_deck, window)
+    
+    trends = []
+    for period_start, rolling_win_rate in zip(starts, rolling):
+        bucket = periods[period_start]
+        total = bucket["counts"]["total"]
+        trends.append({
+            "start": period_start.isoformat(),
+            **summarize_record(bucket["counts"]),
+            "archetypes": [
+                {"archetype": name, "matches": count, "share": win_rate(count, total)}
+                for name, count in bucket["archetypes"].most_common()
+            ],
+            "rolling_win_rate": rolling_win_rate
+        })
+    
+    return {"period": period, "window": window, "tz": zone.key, "trends": trends}
+
+def query_rolling_win_rates(ends, my_deck=None, window=TRENDS_WINDOW):
+    """Win rate over the last window matches before each instant in ends (None before the first match)"""
+    if not ends:
+        return []
+    deck_filter = "AND my_deck = %s" if my_deck else ""
+    # One short index scan per instant, however long the history
+    query = f"""
+        SELECT (
+            SELECT AVG(result_match) FROM (
+                SELECT result_match FROM matches
+                WHERE date_time < e.value {deck_filter}
+                ORDER BY date_time DESC, id DESC LIMIT %s
+            ) w
+        ) as rate
+        FROM {sql_list_table("e", "timestamptz")}
+        ORDER BY e.value
+    """
+    params = [*([my_deck] if my_deck else []), window, list_param(ends)]
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        return [round(float(row["rate"]) * 100, 1) if row["rate"] is not None else None for row in cur.fetchall()]
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Meta Decklist Aggregation
+# ─────────────────────────────────────────────────────────────────────────────
+
+def estimate_copies(avg_copies):
+    """Round the average copies seen per match to a likely deck count (1-4)"""
+    if avg_copies >= 3.5:
+        return 4
+    elif avg_copies >= 2.5:
+        return 3
+    elif avg_copies >= 1.5:
+        return 2
+    return 1
+
+@app.route("/api/meta/decklists")
+@conditional(db_version)
+@cached_result
+def get_meta_decklists():
+    """
+    Aggregate cards seen per opponent deck archetype to estimate decklists.
+    Normalizes similar archetype names. Optional filters: min_matches (default 5),
+    min_appearance_rate (default 20), date_from / date_to.
+    """
+    try:
+        min_matches = int(request.args.get("min_matches", 5))
+        min_appearance_rate = float(request.args.get("min_appearance_rate", 20))
+    except ValueError:
+        return jsonify({"error": "min_matches and min_appearance_rate must be numbers"}), 400
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    date_clauses, params = date_range_sql("date_time", start, end)
+    where_clauses = ["opp_archetype IS NOT NULL", *date_clauses]
+    params.append(min_matches)
+    
+    # Per-archetype, per-card frequencies for every qualifying archetype at once
+    if len(where_clauses) == 1:
+        # All-time view comes straight from the rollup
+        query = """
+            WITH archetypes AS (
+                SELECT opp_archetype, COUNT(*) as match_count FROM matches
+                WHERE opp_archetype IS NOT NULL
+                GROUP BY opp_archetype
+                HAVING COUNT(*) >= %s
+            )
+            SELECT a.opp_archetype, a.match_count, c.name as card_name,
+                   SUM(r.times_seen) as times_seen,
+                   SUM(r.matches) as matches_appeared
+            FROM archetypes a
+            JOIN card_rollup r ON r.opp_archetype = a.opp_archetype
+            JOIN cards c ON c.id = r.card_id
+            GROUP BY a.opp_archetype, a.match_count, c.id
+            ORDER BY a.match_count DESC, a.opp_archetype, matches_appeared DESC, times_seen DESC
+        """
+    else:
+        # Date windows aren't in the rollup; aggregate the raw sightings
+        query = f"""
+            WITH scoped AS (
+                SELECT id, opp_archetype FROM matches
+                WHERE {" AND ".join(where_clauses)}
+            ), archetypes AS (
+                SELECT opp_archetype, COUNT(*) as match_count FROM scoped
+                GROUP BY opp_archetype
+                HAVING COUNT(*) >= %s
+            )
+            SELECT a.opp_archetype, a.match_count, c.name as card_name,
+                   SUM(cs.quantity) as times_seen,
+                   COUNT(*) as matches_appeared
+            FROM archetypes a
+            JOIN scoped s ON s.opp_archetype = a.opp_archetype
+            JOIN cards_seen cs ON cs.match_id = s.id
+            JOIN cards c ON c.id = cs.card_id
+            GROUP BY a.opp_archetype, a.match_count, c.id
+            ORDER BY a.match_count DESC, a.opp_archetype, matches_appeared DESC, times_seen DESC
+        """
+    
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    
+    result = []
+    entry = None
+    
+    for row in rows:
+        if entry is None or entry["archetype"] != row["opp_archetype"]:
+            match_count = row["match_count"]
+            entry = {
+                "archetype": row["opp_archetype"],
+                "match_count": match_count,
+                "estimated_deck": [],
+                "total_estimated_cards": 0,
+                "confidence": min(100, round(match_count * 5))  # More matches = higher confidence, cap at 100
+            }
+            result.append(entry)
+        
+        times_seen = row["times_seen"]
+        matches_appeared = row["matches_appeared"]
+        
+        # Appearance rate = % of matches this card appeared in
+        appearance_rate = round(matches_appeared / match_count * 100, 1)
+        
+        # Only include cards that appear in enough matches
+        if appearance_rate < min_appearance_rate:
+            continue
+        
+        # Estimate copies based on average times seen per match it appeared
+        estimated_copies = estimate_copies(times_seen / matches_appeared)
+        
+        entry["estimated_deck"].append({
             "card": row["card_name"],
-            "times_seen": row["times_seen"],
-            "matches_appeared": row["matches_appeared"],
+            "estimated_copies": estimated_copies,
             "appearance_rate": appearance_rate,
-            "avg_copies": round(avg_copies, 1),
-            "times_in_wins": row["times_in_wins"],
-            "times_in_losses": row["times_in_losses"]
+            "times_seen": times_seen,
+            "matches_appeared": matches_appeared
         })
+        entry["total_estimated_cards"] += estimated_copies
     
-    # Get your win rate against this archetype
-    cur.execute(f"""
-        SELECT COUNT(*) as total,
-               SUM(CASE WHEN result_match = 1 THEN 1 ELSE 0 END) as wins
-        FROM matches WHERE id IN ({placeholders})
-    """, match_ids)
-    stats = cur.fetchone()
-    win_rate = round(stats["wins"] / stats["total"] * 100, 1) if stats["total"] > 0 else 0
+    for entry in result:
+        total_cards = entry["total_estimated_cards"]
+        # Trim or note if over 52
+        entry["deck_status"] = "complete" if 48 <= total_cards <= 56 else "partial" if total_cards < 48 else "overflow"
+        entry["estimated_deck"] = entry["estimated_deck"][:30]  # Cap at 30 unique cards
+    
+    return jsonify(result)
+
+@app.route("/api/meta/archetype/<archetype>")
+@conditional(db_version)
+@cached_result
+def get_archetype_detail(archetype):
+    """Get detailed card breakdown for a specific archetype (normalized)"""
+    with db_cursor() as cur:
+        # Your record against this archetype
+        cur.execute("""
+            SELECT COUNT(*) as total,
+                   SUM(CASE WHEN result_match = 1 THEN 1 ELSE 0 END) as wins
+            FROM matches WHERE opp_archetype = %s
+        """, (archetype,))
+        stats = cur.fetchone()
+        match_count = stats["total"]
+    
+        if match_count == 0:
+            return jsonify({"error": "Archetype not found"}), 404
+    
+        # Get all cards with full stats
+        cur.execute("""
+            SELECT c.name as card_name,
+                   SUM(r.times_seen) as times_seen,
+                   SUM(r.matches) as matches_appeared,
+                   COALESCE(SUM(r.times_seen) FILTER (WHERE r.result_match = 1), 0) as times_in_wins,
+                   COALESCE(SUM(r.times_seen) FILTER (WHERE r.result_match = 0), 0) as times_in_losses
+            FROM card_rollup r
+            JOIN cards c ON c.id = r.card_id
+            WHERE r.opp_archetype = %s
+            GROUP BY c.id
+            ORDER BY matches_appeared DESC, times_seen DESC
+        """, (archetype,))
+    
+        cards = []
+        for row in cur.fetchall():
+            appearance_rate = round(row["matches_appeared"] / match_count * 100, 1)
+            avg_copies = row["times_seen"] / row["matches_appeared"] if row["matches_appeared"] > 0 else 0
+        
+            cards.append({
+                "card": row["card_name"],
+                "times_seen": row["times_seen"],
+                "matches_appeared": row["matches_appeared"],
+                "appearance_rate": appearance_rate,
+                "avg_copies": round(avg_copies, 1),
+                "times_in_wins": row["times_in_wins"],
+                "times_in_losses": row["times_in_losses"]
+            })
     
-    cur.close()
-    conn.close()
+    win_rate = round(stats["wins"] / stats["total"] * 100, 1) if stats["total"] > 0 else 0
     
     return jsonify({
         "archetype": archetype,
@@ -865,6 +3176,46 @@ def get_archetype_detail(archetype):
         "cards": cards
     })
 
+@app.route("/api/archetype-aliases", methods=["GET"])
+def get_archetype_aliases():
+    with db_cursor() as cur:
+        cur.execute("SELECT alias, canonical FROM archetype_aliases ORDER BY canonical, alias")
+        rows = [dict(row) for row in cur.fetchall()]
+    return jsonify(rows)
+
+@app.route("/api/archetype-aliases", methods=["POST"])
+def set_archetype_alias():
+    """Add or change an alias and re-normalize the matches it covers"""
+    data = request.json
+    alias = (data.get("alias") or "").lower().strip()
+    canonical = (data.get("canonical") or "").strip()
+    if not alias or not canonical:
+        return jsonify({"error": "alias and canonical are required"}), 400
+    
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO archetype_aliases (alias, canonical) VALUES (%s, %s)
+            ON CONFLICT (alias) DO UPDATE SET canonical = EXCLUDED.canonical
+        """, (alias, canonical))
+        updated = renormalize_archetypes(cur, aliases=[alias])
+        bump_data_version(cur)
+    return jsonify({"success": True, "updated": updated})
+
+@app.route("/api/archetype-aliases/<alias>", methods=["DELETE"])
+def delete_archetype_alias(alias):
+    """Remove an alias and re-normalize the matches it covered"""
+    alias = alias.lower().strip()
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM archetype_aliases WHERE alias = %s", (alias,))
+        updated = renormalize_archetypes(cur, aliases=[alias])
+        bump_data_version(cur)
+    return jsonify({"success": True, "updated": updated})
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    """Hit/miss counters of this worker's result cache"""
+    return jsonify({"pid": os.getpid(), **result_cache.stats()})
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Routes - Decklists
@@ -872,94 +3223,138 @@ def get_archetype_detail(archetype):
 
 @app.route("/api/decklists", methods=["GET"])
 def get_decklists():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM decklists ORDER BY created_at DESC")
-    rows = [dict(row) for row in cur.fetchall()]
-    cur.close()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute("SELECT * FROM decklists ORDER BY created_at DESC")
+        rows = [dict(row) for row in cur.fetchall()]
     return jsonify(rows)
 
 @app.route("/api/decklists", methods=["POST"])
 def add_decklist():
     data = request.json
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO decklists (name, cards, created_at, is_public)
-        VALUES (%s, %s, %s, %s)
-    """, (
-        data.get("name", "Unnamed Deck"),
-        json.dumps(data.get("cards", {})),
-        now_iso(),
-        1 if data.get("is_public") else 0
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute("""
+            INSERT INTO decklists (name, cards, created_at, is_public)
+            VALUES (%s, %s, %s, %s)
+        """, (
+            data.get("name", "Unnamed Deck"),
+            json.dumps(data.get("cards", {})),
+            now_iso(),
+            1 if data.get("is_public") else 0
+        ))
+        bump_data_version(cur)
     return jsonify({"success": True})
 
 @app.route("/api/decklists/<int:deck_id>", methods=["DELETE"])
 def delete_decklist(deck_id):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM decklists WHERE id = %s", (deck_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute("DELETE FROM decklists WHERE id = %s", (deck_id,))
+        bump_data_version(cur)
     return jsonify({"success": True})
 
 @app.route("/api/my-decks")
+@conditional(db_version)
 def get_my_deck_names():
     """Get list of deck names for dropdown"""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT name FROM decklists ORDER BY name")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_cursor() as cur:
+        cur.execute("SELECT DISTINCT name FROM decklists ORDER BY name")
+        rows = cur.fetchall()
     return jsonify([row["name"] for row in rows])
 
+OPPONENTS_LIMIT = 50
+OPPONENTS_MAX_LIMIT = 500
+
 @app.route("/api/opponents")
+@conditional(db_version)
 def get_opponents():
-    """Get list of opponent names with their most recent deck"""
-    conn = get_db()
-    cur = conn.cursor()
-    # Use DISTINCT ON to get one row per opponent with their most recent match
-    cur.execute("""
-        SELECT DISTINCT ON (opp_name) opp_name, opp_deck, date_time as last_played
-        FROM matches 
-        WHERE opp_name != '' AND opp_name IS NOT NULL
-        ORDER BY opp_name, date_time DESC
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    """
+    Opponents whose name starts with q (case-insensitive), by name, with
+    their most recent deck and head-to-head record (?q=...&limit=50)
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", OPPONENTS_LIMIT)), 1), OPPONENTS_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    prefix = request.args.get("q", "")
+    
+    query = "SELECT name, last_deck, last_played, matches, wins, losses FROM opponents"
+    params = []
+    if prefix:
+        # Every key starting with the prefix sorts below prefix + the highest code point
+        query += " WHERE name_key >= lower(%s) AND name_key < lower(%s) || %s"
+        params += [prefix, prefix, chr(0x10FFFF)]
+    query += " ORDER BY name_key, name LIMIT %s"
+    params.append(limit)
+    
+    with db_cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
     return jsonify([{
-        "name": row["opp_name"],
-        "deck": row["opp_deck"],
-        "last_played": row["last_played"]
+        "name": row["name"],
+        "deck": row["last_deck"],
+        "last_played": iso_timestamp(row["last_played"]),
+        "matches": row["matches"],
+        "wins": row["wins"],
+        "losses": row["losses"]
     } for row in rows])
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Live Events
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.route("/api/events")
+def event_stream():
+    """
+    Server-Sent Events: one JSON message per committed match change
+    (match_added, match_deleted, cards_changed, matches_imported), or
+    resync when the client should reload instead. Streams end after
+    SSE_MAX_AGE so they rotate; past SSE_MAX_STREAMS this returns 503.
+    """
+    subscription = events.subscribe()
+    if subscription is None:
+        response = jsonify({"error": "Too many live streams open; retry later"})
+        response.headers["Retry-After"] = str(SSE_RETRY_AFTER)
+        return response, 503
+    
+    def stream():
+        deadline = time.monotonic() + SSE_MAX_AGE
+        yield "retry: 3000\n\n"
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                payload = subscription.get(timeout=min(SSE_KEEPALIVE, remaining))
+            except queue.Empty:
+                # Keeps proxies from timing out the stream, and notices closed clients
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {payload}\n\n"
+    
+    response = Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # Runs even if the stream is closed before it starts, unlike a finally in stream()
+    response.call_on_close(lambda: events.unsubscribe(subscription))
+    return response
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Routes - Session Stats
 # ─────────────────────────────────────────────────────────────────────────────
 
 @app.route("/api/session")
 def session_stats():
-    today = datetime.now().strftime("%Y-%m-%d")
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT * FROM matches 
-        WHERE date_time >= %s
-        ORDER BY date_time DESC, id DESC
-    """, (today + " 00:00",))
-    
-    matches = [dict(row) for row in cur.fetchall()]
-    cur.close()
-    conn.close()
+    """Today's matches, where today starts at midnight in ?tz="""
+    try:
+        zone = request_zone()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    today = datetime.now(zone).replace(hour=0, minute=0, second=0, microsecond=0)
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT * FROM matches 
+            WHERE date_time >= %s
+            ORDER BY date_time DESC, id DESC
+        """, (today,))
+    
+        matches = [{**row, "date_time": iso_timestamp(row["date_time"])} for row in cur.fetchall()]
     
     wins = sum(1 for m in matches if m["result_match"] == 1)
     
@@ -971,44 +3366,421 @@ def session_stats():
         "win_rate": round(wins / len(matches) * 100, 1) if matches else 0
     })
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Routes - Bulk Import
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Export column -> match field; JSONL records may use either form
+IMPORT_COLUMNS = {
+    "Date": "date_time",
+    "My Deck": "my_deck",
+    "Opponent": "opp_name",
+    "Their Deck": "opp_deck",
+    "Result": "result",
+    "On Play": "on_play",
+    "Notes": "notes",
+    "Cards Seen": "cards_seen"
+}
+
+# Cards seen are written as one "; "-separated column (card names contain commas)
+CARDS_SEPARATOR = "; "
+
+def import_text(fields, field):
+    """A free-text field as a string ("" when missing); lists and objects are rejected"""
+    value = fields.get(field)
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"Invalid {field} {value!r} (expected text)")
+    return str(value)
+
+def parse_import_record(record, zone):
+    """
+    Validate one CSV/JSONL record into a match dict, reading its date in zone;
+    raises ValueError with the reason.
+    """
+    fields = {IMPORT_COLUMNS.get(key, key): value for key, value in record.items()}
+    
+    date_time = fields.get("date_time") or ""
+    if not isinstance(date_time, str):
+        raise ValueError(f"Invalid date {date_time!r} (expected YYYY-MM-DD HH:MM)")
+    date_time = date_time.strip()
+    try:
+        date_time = parse_local_time(date_time, zone)
+    except ValueError:
+        # ISO 8601 with an offset, as the JSONL export writes it
+        try:
+            parsed = datetime.fromisoformat(date_time.replace("Z", "+00:00"))
+        except ValueError:
+            parsed = None
+        if parsed is None or parsed.tzinfo is None:
+            raise ValueError(f"Invalid date {date_time!r} (expected YYYY-MM-DD HH:MM)")
+        date_time = parsed.replace(microsecond=0)
+    
+    result = str(fields.get("result", "")).strip().lower()
+    if result in ("win", "1"):
+        result_match = 1
+    elif result in ("loss", "0"):
+        result_match = 0
+    else:
+        raise ValueError(f"Invalid result {fields.get('result')!r}")
+    
+    on_play = fields.get("on_play")
+    on_play = "" if on_play is None else str(on_play).strip().lower()
+    if on_play in ("yes", "1", "true"):
+        on_play_start = 1
+    elif on_play in ("no", "0", "false"):
+        on_play_start = 0
+    elif on_play in ("", "unknown", "none", "null"):
+        on_play_start = None
+    else:
+        raise ValueError(f"Invalid on play value {fields.get('on_play')!r}")
+    
+    cards = fields.get("cards_seen") or []
+    if isinstance(cards, str):
+        cards = [c.strip() for c in cards.split(CARDS_SEPARATOR.strip()) if c.strip()]
+    if not isinstance(cards, list) or not all(isinstance(c, str) for c in cards):
+        raise ValueError(f"Invalid cards seen {fields.get('cards_seen')!r} (expected a list of card names)")
+    canonical = [CARD_INDEX.canonicalize(c) for c in cards]
+    unknown = [c for c, name in zip(cards, canonical) if name is None]
+    if unknown:
+        raise ValueError(f"Unknown cards: {', '.join(unknown)}")
+    cards = canonical
+    
+    return {
+        "date_time": date_time,
+        "my_deck": import_text(fields, "my_deck"),
+        "opp_name": import_text(fields, "opp_name"),
+        "opp_deck": import_text(fields, "opp_deck"),
+        "result_match": result_match,
+        "on_play_start": on_play_start,
+        "notes": import_text(fields, "notes"),
+        "cards_seen": cards
+    }
+
+def read_import_records(stream, fmt):
+    """Yield (row_number, record) from a CSV or JSONL text stream"""
+    if fmt == "csv":
+        for row_number, record in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, record
+    else:
+        for row_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield row_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_number, e
+
+MATCH_COLUMNS = (
+    "id", "date_time", "my_deck", "opp_name", "opp_deck", "opp_archetype",
+    "result_match", "on_play_start", "notes",
+    "detected_archetype", "detected_score", "detected_confidence",
+)
+
+def import_matches(stream, fmt, zone):
+    """
+    Validate every record, then load the valid ones into matches and
+    cards_seen with COPY (executemany on SQLite) in a single transaction.
+    Dates are wall-clock times in zone. Returns
+    {"imported": n, "errors": [{"row": n, "error": msg}, ...]}.
+    """
+    matches = []
+    errors = []
+    for row_number, record in read_import_records(stream, fmt):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError(f"Invalid JSON: {record}")
+            matches.append(parse_import_record(record, zone))
+        except ValueError as e:
+            errors.append({"row": row_number, "error": str(e)})
+    
+    if not matches:
+        return {"imported": 0, "errors": errors}
+    
+    with db_cursor() as cur:
+        # First, so SQLite takes its write lock before anything is read
+        bump_data_version(cur)
+        
+        # Canonical archetypes resolved in Python, same rules as canonical_archetype_sql
+        cur.execute("SELECT alias, canonical FROM archetype_aliases")
+        aliases = {row["alias"]: row["canonical"] for row in cur.fetchall()}
+        
+        # Reserve ids up front so cards can reference their match in the same pass
+        ids = reserve_match_ids(cur, len(matches))
+        
+        bulk_insert(cur, "matches", MATCH_COLUMNS, (
+            (
+                match_id, m["date_time"], m["my_deck"], m["opp_name"], m["opp_deck"],
+                aliases.get(m["opp_deck"].lower().strip(" "), m["opp_deck"] or None),
+                m["result_match"], m["on_play_start"], m["notes"],
+                *top_archetype(m["cards_seen"])
+            )
+            for match_id, m in zip(ids, matches)
+        ))
+        ids_by_name = card_ids(cur, CARD_LIST)
+        bulk_insert(cur, "cards_seen", CARDS_SEEN_COLUMNS, (
+            row
+            for match_id, m in zip(ids, matches)
+            for row in card_rows(match_id, m["cards_seen"], ids_by_name)
+        ))
+        
+        adjust_card_rollup(cur, sql_in_list("m.id", "integer"), (list_param(ids),), 1)
+        adjust_daily_rollup(cur, sql_in_list("m.id", "integer"), (list_param(ids),), 1)
+        adjust_opponents(cur, sql_in_list("m.id", "integer"), (list_param(ids),), 1)
+        # Too many matches to apply one by one; every worker rebuilds card_pairs on its next read
+        bump_pairs_version(cur)
+        publish_event(cur, {"type": "matches_imported", "count": len(matches)})
+    
+    return {"imported": len(matches), "errors": errors}
+
+def import_format(filename, requested=None):
+    fmt = (requested or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    if fmt in ("jsonl", "ndjson"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ValueError("Unknown import format (use csv or jsonl)")
+
+@app.route("/api/import", methods=["POST"])
+def import_matches_api():
+    """Bulk import matches from an uploaded CSV/JSONL file (or raw request body); dates are read in ?tz="""
+    upload = request.files.get("file")
+    try:
+        fmt = import_format(upload.filename if upload else None, request.args.get("format"))
+        zone = request_zone()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if upload:
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    else:
+        stream = io.StringIO(request.get_data(as_text=True), newline="")
+    
+    result = import_matches(stream, fmt, zone)
+    return jsonify({"success": result["imported"] > 0 or not result["errors"], **result})
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Routes - Export
 # ─────────────────────────────────────────────────────────────────────────────
 
-@app.route("/api/export/csv")
-def export_csv():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT date_time, my_deck, opp_name, opp_deck, result_match, on_play_start, notes
-        FROM matches ORDER BY date_time DESC
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
+# Rows per fetch from the server-side cursor, and per Parquet row group
+EXPORT_CHUNK_SIZE = 2000
+
+def iter_export_chunks(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Every match, newest first, with its card names, as lists of at most
+    chunk_size rows. PostgreSQL reads through a named (server-side) cursor and
+    SQLite steps its statement as rows are fetched, so memory stays flat.
+    """
+    with get_db() as conn:
+        if USE_SQLITE:
+            cur = new_cursor(conn)
+        else:
+            cur = conn.cursor(name="export_matches")
+            cur.itersize = chunk_size
+        # Card names missing from the cache are read on the same connection, between chunks
+        names = new_cursor(conn)
+        cur.execute(f"""
+            SELECT m.id, m.date_time, m.my_deck, m.opp_name, m.opp_deck, m.opp_archetype,
+                   m.result_match, m.on_play_start, m.notes, m.detected_archetype,
+                   {sql_card_list("m.id")} as cards_seen
+            FROM matches m ORDER BY m.date_time DESC, m.id DESC
+        """)
+        while chunk := cur.fetchmany(chunk_size):
+            yield [
+                {**row, "date_time": as_datetime(row["date_time"]) if row["date_time"] else None,
+                 "cards_seen": card_list(names, row["cards_seen"])}
+                for row in chunk
+            ]
+        names.close()
+        cur.close()
+
+def export_csv_chunks(zone):
+    """CSV in the import format (dates as wall-clock times in zone), one piece per chunk"""
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow(["Date", "My Deck", "Opponent", "Their Deck", "Result", "On Play", "Notes"])
+    writer.writerow(list(IMPORT_COLUMNS))
+    for chunk in iter_export_chunks():
+        for row in chunk:
+            writer.writerow([
+                row["date_time"].astimezone(zone).strftime("%Y-%m-%d %H:%M") if row["date_time"] else "",
+                row["my_deck"],
+                row["opp_name"],
+                row["opp_deck"],
+                "Win" if row["result_match"] == 1 else "Loss",
+                "Yes" if row["on_play_start"] == 1 else "No" if row["on_play_start"] == 0 else "Unknown",
+                row["notes"],
+                CARDS_SEPARATOR.join(row["cards_seen"])
+            ])
+        yield output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+
+def export_jsonl_chunks():
+    """One JSON object per match, keyed by import field names, with ISO 8601 dates"""
+    for chunk in iter_export_chunks():
+        yield "".join(json.dumps({
+            "id": row["id"],
+            "date_time": iso_timestamp(row["date_time"]),
+            "my_deck": row["my_deck"],
+            "opp_name": row["opp_name"],
+            "opp_deck": row["opp_deck"],
+            "opp_archetype": row["opp_archetype"],
+            "result": "win" if row["result_match"] == 1 else "loss",
+            "on_play": row["on_play_start"],
+            "notes": row["notes"],
+            "detected_archetype": row["detected_archetype"],
+            "cards_seen": row["cards_seen"]
+        }) + "\n" for row in chunk).encode()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain()"""
     
-    for row in rows:
-        writer.writerow([
-            row["date_time"],
-            row["my_deck"],
-            row["opp_name"],
-            row["opp_deck"],
-            "Win" if row["result_match"] == 1 else "Loss",
-            "Yes" if row["on_play_start"] == 1 else "No" if row["on_play_start"] == 0 else "Unknown",
-            row["notes"]
-        ])
-    
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name=f"vibes_matches_{datetime.now().strftime('%Y%m%d')}.csv"
+    def __init__(self):
+        self.pieces = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b"".join(self.pieces)
+        self.pieces = []
+        return data
+
+def export_parquet_chunks():
+    """Parquet, one row group per chunk; the footer goes out with the last piece"""
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("date_time", pa.timestamp("s", tz="UTC")),
+        ("my_deck", pa.string()),
+        ("opp_name", pa.string()),
+        ("opp_deck", pa.string()),
+        ("opp_archetype", pa.string()),
+        ("result_match", pa.int8()),
+        ("on_play_start", pa.int8()),
+        ("notes", pa.string()),
+        ("detected_archetype", pa.string()),
+        ("cards_seen", pa.list_(pa.string())),
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in iter_export_chunks():
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+def gzip_chunks(chunks):
+    """Gzip a byte stream piece by piece (compress_response skips streamed bodies)"""
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+@app.route("/api/export/<fmt>")
+def export_matches(fmt):
+    """
+    Stream every match with its cards as CSV (the import format, dates in ?tz=),
+    JSONL, or Parquet (needs pyarrow). Text formats are gzipped for clients
+    that accept it.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown export format (use {', '.join(EXPORT_FORMATS)})"}), 404
+    try:
+        zone = request_zone()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if fmt == "csv":
+        chunks = export_csv_chunks(zone)
+    elif fmt == "jsonl":
+        chunks = export_jsonl_chunks()
+    elif pq is None:
+        return jsonify({"error": "Parquet export needs pyarrow (pip install pyarrow)"}), 501
+    else:
+        chunks = export_parquet_chunks()
+    
+    response = Response(mimetype=EXPORT_FORMATS[fmt])
+    if fmt != "parquet" and request.accept_encodings["gzip"]:
+        chunks = gzip_chunks(chunks)
+        response.headers["Content-Encoding"] = "gzip"
+    response.response = stream_with_context(chunks)
+    response.vary.add("Accept-Encoding")
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=vibes_matches_{datetime.now(zone).strftime('%Y%m%d')}.{fmt}"
     )
+    return response
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CLI Commands
+# ─────────────────────────────────────────────────────────────────────────────
+
+@app.cli.command("renormalize-archetypes")
+def renormalize_archetypes_command():
+    """Recompute every match's canonical archetype from the alias table"""
+    with db_cursor() as cur:
+        updated = renormalize_archetypes(cur)
+    print(f"Re-normalized {updated} matches")
+
+@app.cli.command("rebuild-card-rollup")
+def rebuild_card_rollup_command():
+    """Recompute the card analytics rollup from cards_seen"""
+    with db_cursor() as cur:
+        rows = rebuild_card_rollup(cur)
+        bump_data_version(cur)
+    print(f"Rebuilt card rollup ({rows} rows)")
+
+@app.cli.command("rebuild-daily-rollup")
+def rebuild_daily_rollup_command():
+    """Recompute the daily match counts behind /api/trends"""
+    with db_cursor() as cur:
+        rows = rebuild_daily_rollup(cur)
+        bump_data_version(cur)
+    print(f"Rebuilt daily rollup ({rows} rows)")
+
+@app.cli.command("rebuild-opponents")
+def rebuild_opponents_command():
+    """Recompute the opponents directory behind /api/opponents"""
+    with db_cursor() as cur:
+        rows = rebuild_opponents(cur)
+        bump_data_version(cur)
+    print(f"Rebuilt opponents ({rows} rows)")
+
+@app.cli.command("reclassify-matches")
+@click.option("--chunk-size", default=RECLASSIFY_CHUNK_SIZE, show_default=True, help="Matches streamed per chunk")
+@click.option("--workers", type=int, default=None, help="Scoring processes (default: CPU count)")
+def reclassify_matches_command(chunk_size, workers):
+    """Re-run archetype detection over every match's cards_seen"""
+    changed = reclassify_matches(chunk_size=chunk_size, workers=workers)
+    print(f"Reclassified matches ({changed} changed)")
+
+@app.cli.command("import-matches")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None, help="Default: from file extension")
+@click.option("--tz", default=APP_TIMEZONE, show_default=True, help="Time zone the file's dates are in")
+def import_matches_command(path, fmt, tz):
+    """Bulk import matches (the CSV/JSONL export format) from CSV or JSONL"""
+    try:
+        fmt = import_format(path, fmt)
+        zone = zone_named(tz)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        result = import_matches(f, fmt, zone)
+    for error in result["errors"]:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"Imported {result['imported']} matches ({len(result['errors'])} rows rejected)")
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Initialize and Run
@@ -0,0 +1,410 @@
+"""
+Vibes TCG Tracker v2 - Benchmarks
+Synthetic match history generator and a latency harness over every route.
+
+    python benchmark.py generate --database-url postgresql://localhost/vibes_bench --matches 100000
+    python benchmark.py run --database-url postgresql://localhost/vibes_bench --scales 1000,10000,100000
+    python benchmark.py run --database-url sqlite:///bench.db --scales 1000,10000
+    python benchmark.py compare benchmarks/abc1234.json benchmarks/def5678.json
+
+Both commands WIPE the target database, so point them at a scratch one
+(never the DATABASE_URL the app normally uses).
+"""
+
+import click
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DEFAULT_SCALES = "1000,10000,100000"
+
+# Loaded by load_app() once DATABASE_URL points at the scratch database
+app = None
+
+def load_app(database_url, cache):
+    global app
+    if database_url == os.environ.get("DATABASE_URL"):
+        raise click.UsageError("Refusing to benchmark against DATABASE_URL; use a scratch database")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["METRICS_ENABLED"] = "1"
+    os.environ["SERVER_TIMING"] = "1"
+    os.environ["SLOW_QUERY_MS"] = "1000000"
+    if not cache:
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+    import app as app_module
+    app = app_module
+    return app
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Synthetic History
+# ─────────────────────────────────────────────────────────────────────────────
+
+class HistoryGenerator:
+    """
+    Deterministic (per seed) match histories shaped like real logs: a few
+    decks of our own, a pool of opponents who mostly stick to a favourite
+    archetype, opp_deck typed in assorted spellings, cards drawn from each
+    archetype's signature/supporting lists plus some noise from CARD_LIST,
+    and results driven by a fixed matchup table.
+    """
+
+    def __init__(self, seed=1, opponents=500, archetypes=None, my_decks=4, days=365):
+        self.rng = random.Random(seed)
+        names = sorted(app.ARCHETYPES)
+        self.archetypes = names[:archetypes] if archetypes else names
+        self.my_decks = self.rng.sample(names, min(my_decks, len(names)))
+        # Popularity falls off like a real meta: a few decks dominate
+        self.popularity = [1 / (rank + 1) for rank in range(len(self.archetypes))]
+        self.rng.shuffle(self.popularity)
+        self.opponents = [
+            (f"player{i:05d}", self.rng.choices(self.archetypes, self.popularity)[0])
+            for i in range(opponents)
+        ]
+        self.matchups = {
+            (mine, theirs): self.rng.uniform(0.35, 0.65)
+            for mine in self.my_decks for theirs in self.archetypes
+        }
+        self.spellings = {}
+        for alias, canonical in app.ARCHETYPE_ALIASES.items():
+            self.spellings.setdefault(canonical, []).append(alias)
+        self.start = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=days)
+        self.days = days
+
+    def opp_deck_text(self, archetype):
+        roll = self.rng.random()
+        if roll < 0.05:
+            return ""
+        if roll < 0.25 and self.spellings.get(archetype):
+            return self.rng.choice(self.spellings[archetype])
+        if roll < 0.35:
+            return archetype.lower()
+        return archetype
+
+    def cards_seen(self, archetype):
+        data = app.ARCHETYPES[archetype]
+        cards = [c for c in data["signature"] if self.rng.random() < 0.75]
+        cards += [c for c in data["supporting"] if self.rng.random() < 0.45]
+        cards += self.rng.sample(app.CARD_LIST, self.rng.randint(0, 3))
+        # Extra copies of cards that were seen more than once
+        cards += [c for c in cards if self.rng.random() < 0.15]
+        return cards
+
+    def matches(self, count):
+        """Yield (date_time, my_deck, opp_name, opp_deck, archetype, result, on_play, notes, cards) in date order"""
+        offsets = sorted(self.rng.random() * self.days * 86400 for _ in range(count))
+        for offset in offsets:
+            my_deck = self.rng.choice(self.my_decks)
+            opp_name, favourite = self.rng.choice(self.opponents)
+            archetype = favourite if self.rng.random() < 0.8 else self.rng.choices(self.archetypes, self.popularity)[0]
+            on_play = self.rng.choice((1, 0, 1, 0, None))
+            win_chance = self.matchups[(my_deck, archetype)] + (0.05 if on_play == 1 else -0.05 if on_play == 0 else 0)
+            yield (
+                self.start + timedelta(seconds=int(offset)),
+                my_deck,
+                opp_name,
+                self.opp_deck_text(archetype),
+                archetype,
+                1 if self.rng.random() < win_chance else 0,
+                on_play,
+                "" if self.rng.random() < 0.9 else "close game",
+                self.cards_seen(archetype),
+            )
+
+BENCH_TABLES = ("cards_seen", "matches", "card_rollup", "daily_rollup", "daily_archetypes", "opponents", "decklists", "idempotency_keys")
+
+def reset_database():
+    with app.db_cursor() as cur:
+        if app.USE_SQLITE:
+            for table in BENCH_TABLES:
+                cur.execute(f"DELETE FROM {table}")
+            cur.execute("DELETE FROM sqlite_sequence")
+        else:
+            cur.execute(f"TRUNCATE {', '.join(BENCH_TABLES)} RESTART IDENTITY CASCADE")
+        app.bump_data_version(cur)
+        app.bump_pairs_version(cur)
+
+def generate_history(count, seed=1, opponents=500, archetypes=None, batch_size=50000):
+    """Replace the database contents with count synthetic matches; returns seconds taken"""
+    started = time.perf_counter()
+    generator = HistoryGenerator(seed=seed, opponents=opponents, archetypes=archetypes)
+    reset_database()
+
+    with app.db_cursor() as cur:
+        cur.execute("SELECT alias, canonical FROM archetype_aliases")
+        aliases = {row["alias"]: row["canonical"] for row in cur.fetchall()}
+
+        for deck in generator.my_decks:
+            cur.execute(
+                "INSERT INTO decklists (name, cards, created_at, is_public) VALUES (%s, %s, %s, 0)",
+                (deck, json.dumps({c: 3 for c in app.ARCHETYPES[deck]["signature"]}), app.now_iso())
+            )
+
+        card_ids = app.card_ids(cur, app.CARD_LIST)
+        match_id = 0
+        rows = generator.matches(count)
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            app.bulk_insert(cur, "matches", app.MATCH_COLUMNS, (
+                (
+                    i, date_time, my_deck, opp_name, opp_deck,
+                    aliases.get(opp_deck.lower().strip(" "), opp_deck or None),
+                    result, on_play, notes, *app.top_archetype(cards)
+                )
+                for i, (date_time, my_deck, opp_name, opp_deck, _, result, on_play, notes, cards) in enumerate(batch, match_id + 1)
+            ))
+            app.bulk_insert(cur, "cards_seen", app.CARDS_SEEN_COLUMNS, (
+                card_row
+                for i, row in enumerate(batch, match_id + 1)
+                for card_row in app.card_rows(i, row[-1], card_ids)
+            ))
+            match_id += len(batch)
+
+        # SQLite's AUTOINCREMENT follows explicit ids on its own
+        if not app.USE_SQLITE:
+            cur.execute("SELECT setval(pg_get_serial_sequence('matches', 'id'), GREATEST(%s, 1))", (match_id,))
+        app.rebuild_card_rollup(cur)
+        app.rebuild_daily_rollup(cur)
+        app.rebuild_opponents(cur)
+        app.bump_data_version(cur)
+        app.bump_pairs_version(cur)
+
+    with app.db_cursor() as cur:
+        cur.execute("ANALYZE matches")
+        cur.execute("ANALYZE cards_seen")
+        cur.execute("ANALYZE card_rollup")
+        cur.execute("ANALYZE daily_rollup")
+        cur.execute("ANALYZE daily_archetypes")
+        cur.execute("ANALYZE opponents")
+    return time.perf_counter() - started
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Harness
+# ─────────────────────────────────────────────────────────────────────────────
+
+SERVER_TIMING_DB = re.compile(r'desc="(\d+) queries, (\d+) rows"')
+
+def bench_routes(client):
+    """(name, method, url, body) for every read route, with arguments picked from the data"""
+    with app.db_cursor() as cur:
+        cur.execute("SELECT my_deck, opp_archetype, date_time FROM matches ORDER BY id DESC LIMIT 1")
+        latest = cur.fetchone() or {"my_deck": "", "opp_archetype": "", "date_time": app.utc_now()}
+    my_deck = latest["my_deck"] or ""
+    archetype = latest["opp_archetype"] or next(iter(app.ARCHETYPES))
+    last_played = app.as_datetime(latest["date_time"])
+    date_to = last_played.strftime("%Y-%m-%d")
+    date_from = (last_played - timedelta(days=30)).strftime("%Y-%m-%d")
+    month = f"date_from={date_from}&date_to={date_to}"
+
+    first_page = client.get("/api/matches?limit=50").get_json() or {}
+    cursor = first_page.get("next_cursor") or ""
+    cards = app.ARCHETYPES[next(iter(app.ARCHETYPES))]["signature"]
+
+    return [
+        ("matches", "GET", "/api/matches?limit=50", None),
+        ("matches page 2", "GET", f"/api/matches?limit=50&after={cursor}", None),
+        ("matches filtered", "GET", f"/api/matches?limit=100&my_deck={my_deck}&result=loss&{month}", None),
+        ("stats", "GET", "/api/stats", None),
+        ("stats filtered", "GET", f"/api/stats?my_deck={my_deck}&{month}", None),
+        ("cards in losses", "GET", "/api/analytics/cards-in-losses", None),
+        ("cards in wins", "GET", f"/api/analytics/cards-in-wins?my_deck={my_deck}", None),
+        ("winrate vs card", "GET", "/api/analytics/winrate-vs-card", None),
+        ("card pairs", "GET", f"/api/analytics/card-pairs?my_deck={my_deck}", None),
+        ("dashboard", "GET", f"/api/dashboard?my_deck={my_deck}", None),
+        ("trends", "GET", "/api/trends?period=week", None),
+        ("trends filtered", "GET", f"/api/trends?my_deck={my_deck}&{month}", None),
+        ("meta decklists", "GET", "/api/meta/decklists", None),
+        ("meta decklists dated", "GET", f"/api/meta/decklists?{month}", None),
+        ("meta archetype", "GET", f"/api/meta/archetype/{archetype}", None),
+        ("detect archetype", "POST", "/api/detect-archetype", {"cards": cards}),
+        ("detect archetype batch", "POST", "/api/detect-archetype/batch", {"card_lists": [cards] * 100}),
+        ("card search", "GET", "/api/cards/search?q=peng", None),
+        ("opponents", "GET", "/api/opponents", None),
+        ("opponents prefix", "GET", "/api/opponents?q=player001&limit=8", None),
+        ("my decks", "GET", "/api/my-decks", None),
+        ("session", "GET", "/api/session", None),
+        ("export csv", "GET", "/api/export/csv", None),
+    ]
+
+def write_routes(client, card):
+    """Time a full add / edit / delete cycle on a throwaway match"""
+    timings = []
+
+    def timed(name, method, url, body=None):
+        start = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        timings.append((name, time.perf_counter() - start, response))
+        return response
+
+    created = timed("add match", "POST", "/api/matches", {
+        "my_deck": "Bench", "opp_name": "bench", "opp_deck": "Red Control",
+        "result": "win", "on_play": 1, "cards_seen": [card, card]
+    }).get_json()
+    match_id = created["id"]
+    timed("add card", "POST", f"/api/matches/{match_id}/cards", {"card_name": card})
+    timed("card delta", "POST", f"/api/matches/{match_id}/cards/delta", {"add": [card], "remove": [card]})
+    timed("remove card", "DELETE", f"/api/matches/{match_id}/cards/{card}")
+    timed("delete match", "DELETE", f"/api/matches/{match_id}")
+    return timings
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+def summarize(name, seconds, responses):
+    queries = rows = 0
+    for response in responses:
+        found = SERVER_TIMING_DB.search(response.headers.get("Server-Timing", ""))
+        if found:
+            queries += int(found.group(1))
+            rows += int(found.group(2))
+    ms = [s * 1000 for s in seconds]
+    return {
+        "route": name,
+        "requests": len(ms),
+        "status": sorted({r.status_code for r in responses}),
+        "p50_ms": round(statistics.median(ms), 2),
+        "p95_ms": round(percentile(ms, 95), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "max_ms": round(max(ms), 2),
+        "queries": round(queries / len(responses), 1),
+        "rows": round(rows / len(responses), 1),
+    }
+
+def run_scale(requests, warmup):
+    client = app.app.test_client()
+    results = []
+    for name, method, url, body in bench_routes(client):
+        for _ in range(warmup):
+            client.open(url, method=method, json=body)
+        seconds = []
+        responses = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body)
+            seconds.append(time.perf_counter() - start)
+            responses.append(response)
+        results.append(summarize(name, seconds, responses))
+
+    write_timings = {}
+    card = app.CARD_LIST[0]
+    for _ in range(requests):
+        for name, elapsed, response in write_routes(client, card):
+            write_timings.setdefault(name, ([], []))
+            write_timings[name][0].append(elapsed)
+            write_timings[name][1].append(response)
+    for name, (seconds, responses) in write_timings.items():
+        results.append(summarize(name, seconds, responses))
+    return results
+
+def print_results(scale, results):
+    click.echo(f"\n{scale:,} matches")
+    click.echo(f"{'route':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'queries':>9}{'rows':>10}")
+    for r in results:
+        click.echo(
+            f"{r['route']:<24}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}"
+            f"{r['queries']:>9}{r['rows']:>10}"
+        )
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"]).returncode != 0
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────────────────────────────────────
+
+database_option = click.option(
+    "--database-url", envvar="BENCH_DATABASE_URL", required=True,
+    help="Scratch database to (re)fill; also read from BENCH_DATABASE_URL"
+)
+
+@click.group()
+def cli():
+    """Synthetic data and latency benchmarks for app.py"""
+
+@cli.command()
+@database_option
+@click.option("--matches", default=10000, show_default=True)
+@click.option("--opponents", default=500, show_default=True)
+@click.option("--archetypes", type=int, help="Only use the first N archetypes (default all)")
+@click.option("--seed", default=1, show_default=True)
+def generate(database_url, matches, opponents, archetypes, seed):
+    """Replace the database contents with a synthetic history"""
+    load_app(database_url, cache=False)
+    seconds = generate_history(matches, seed=seed, opponents=opponents, archetypes=archetypes)
+    click.echo(f"Generated {matches:,} matches in {seconds:.1f}s")
+
+@cli.command()
+@database_option
+@click.option("--scales", default=BENCH_DEFAULT_SCALES, show_default=True,
+              help="Comma-separated match counts, e.g. 1000,10000,100000,1000000")
+@click.option("--requests", default=20, show_default=True, help="Timed requests per route")
+@click.option("--warmup", default=2, show_default=True)
+@click.option("--opponents", default=500, show_default=True)
+@click.option("--seed", default=1, show_default=True)
+@click.option("--cache/--no-cache", default=False, show_default=True, help="Keep the analytics result cache on")
+@click.option("--out", type=click.Path(dir_okay=False), help="Results file (default benchmarks/<git revision>.json)")
+def run(database_url, scales, requests, warmup, opponents, seed, cache, out):
+    """Generate each scale, time every route and save the results"""
+    load_app(database_url, cache)
+    report = {
+        "revision": git_revision(),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "requests": requests,
+        "seed": seed,
+        "cache": cache,
+        "scales": {},
+    }
+    for scale in [int(s) for s in scales.split(",") if s.strip()]:
+        generate_seconds = generate_history(scale, seed=seed, opponents=opponents)
+        results = run_scale(requests, warmup)
+        report["scales"][str(scale)] = {"generate_seconds": round(generate_seconds, 1), "routes": results}
+        print_results(scale, results)
+
+    out = out or os.path.join("benchmarks", f"{report['revision']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    click.echo(f"\nSaved {out}")
+
+@cli.command()
+@click.argument("baseline", type=click.File())
+@click.argument("candidate", type=click.File())
+def compare(baseline, candidate):
+    """Show p50/p95 changes between two saved runs"""
+    before = json.load(baseline)
+    after = json.load(candidate)
+    click.echo(f"{before['revision']} -> {after['revision']}")
+    for scale, data in after["scales"].items():
+        if scale not in before["scales"]:
+            continue
+        old = {r["route"]: r for r in before["scales"][scale]["routes"]}
+        click.echo(f"\n{int(scale):,} matches")
+        click.echo(f"{'route':<24}{'p50 ms':<18}{'p95 ms':<18}{'queries':<12}p50 change")
+        for r in data["routes"]:
+            o = old.get(r["route"])
+            if o is None:
+                continue
+            change = (r["p50_ms"] - o["p50_ms"]) / o["p50_ms"] * 100 if o["p50_ms"] else 0
+            click.echo(
+                f"{r['route']:<24}{o['p50_ms']:<7} -> {r['p50_ms']:<7}{o['p95_ms']:<7} -> {r['p95_ms']:<7}"
+                f"{o['queries']:<4} -> {r['queries']:<4}{change:+.0f}%"
+            )
+
+if __name__ == "__main__":
+    cli()